@@ -1,43 +1,367 @@
+import asyncio
+import contextvars
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+from collections import Counter
+from collections.abc import AsyncIterable
+from collections.abc import AsyncIterator
+from contextlib import aclosing
+from contextlib import nullcontext
+from datetime import timedelta
+from typing import BinaryIO
+
+from asyncpg.exceptions import DeadlockDetectedError
+from asyncpg.exceptions import ForeignKeyViolationError
+from fastapi import HTTPException
 from fastapi import UploadFile
+from fastapi.encoders import jsonable_encoder
+from redis.exceptions import LockError
+from redis.exceptions import RedisError
+from sqlalchemy import cast
+from sqlalchemy import func
+from sqlalchemy import Interval
 
 from apps.entities.base import BaseManager
+from apps.entities.imports.schemas import ImportFormat
+from apps.entities.imports.schemas import ImportMode
+from apps.entities.imports.schemas import ImportResult
+from apps.entities.imports.schemas import ImportStatus
+from apps.entities.imports.validator import ImportErrors
 from apps.entities.imports.validator import ImportValidator
+from apps.entities.imports.validator import read_upload
+from apps.entities.projects.managers import ProjectManager
+from apps.entities.teams.cache import TeamIdsCache
 from apps.entities.teams.managers import TeamDataManager
 from apps.entities.teams.managers import TeamManager
-from apps.entities.teams.schemas import TeamMetricCreate
+from apps.entities.teams.schemas import TeamMetricBatch
 from core.contexts import PROJECT_ID
+from core.exceptions import BadRequestException
+from core.exceptions import ConflictException
+from core.exceptions import NotFoundException
+from core.redis import redis_client
 from core.redis import RedisLockClient
+from core.settings import ImportConfig
+from core.settings import ImportLockScope
 from db import get_database
 from db.models import imports
+from db.queries.imports import ImportQuery
+
+logger = logging.getLogger(__name__)
+
+
+def hash_file(file: BinaryIO) -> str:
+    content_hash = hashlib.file_digest(file, "sha256").hexdigest()
+    file.seek(0)
+    return content_hash
+
+
+def spool_file(file: BinaryIO, directory: str) -> tuple[str, str]:
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=directory, prefix="import-", delete=False) as spooled:
+        while block := file.read(shutil.COPY_BUFSIZE):
+            digest.update(block)
+            spooled.write(block)
+    return spooled.name, digest.hexdigest()
+
+
+async def hash_chunks(chunks: AsyncIterable[bytes], digest) -> AsyncIterator[bytes]:
+    async for chunk in chunks:
+        digest.update(chunk)
+        yield chunk
 
 
 class ImportManager(BaseManager):
+    queries: ImportQuery = ImportQuery
     validator: ImportValidator = ImportValidator
     table_model = imports
 
+    lock_scope: ImportLockScope = ImportConfig.get_default().lock_scope
+
+    PROGRESS_TTL = 24 * 60 * 60
+    HEARTBEAT_TTL = 60  # an import without a heartbeat is no longer running
+    _jobs: set[asyncio.Task] = set()
+
+    def _get_lock(self):
+        """With the team scope teams are locked in the transaction as soon as their batches are written."""
+        if self.lock_scope == ImportLockScope.team:
+            return nullcontext()
+        config = ImportConfig.get_default()
+        return RedisLockClient.get_renewable(
+            f"import:{PROJECT_ID.get()}", timeout=config.lock_timeout, blocking_timeout=config.lock_blocking_timeout
+        )
+
     @staticmethod
-    def _get_lock():
-        return RedisLockClient.get(f"import:{PROJECT_ID.get()}")
-
-    async def create(self, file: UploadFile):
-        async with self._get_lock():
-            metrics, teams = await self.validator.validate_create(file)
-            async with get_database().transaction():
-                teams_db = await self._create_missing_teams(teams)
-                await self.queries.create(filename=file.filename)
-                await TeamDataManager().create(
-                    [TeamMetricCreate(**metric.dict(), team_id=teams_db[metric.team]) for metric in metrics]
-                )
+    def _get_progress_key(import_id: int) -> str:
+        return f"import:progress:{import_id}"
+
+    @staticmethod
+    def _get_heartbeat_key(import_id: int) -> str:
+        return f"import:heartbeat:{import_id}"
+
+    @staticmethod
+    def get_upload_format(file: UploadFile) -> ImportFormat:
+        try:
+            return ImportFormat((file.content_type or "").split(";")[0].strip().lower())
+        except ValueError:
+            return ImportFormat.csv
+
+    @staticmethod
+    def _get_result(import_: dict) -> ImportResult:
+        return ImportResult(inserted=import_["inserted"], updated=import_["updated"], unchanged=import_["unchanged"])
+
+    async def _get_by_idempotency_key(self, idempotency_key: str | None) -> dict | None:
+        """An earlier import made with the key, failed imports wrote nothing and are retried."""
+        if idempotency_key is None:
+            return None
+        import_ = await self.queries.get_by_idempotency_key(PROJECT_ID.get(), idempotency_key, ImportStatus.failed)
+        if import_ is not None and await self._fail_interrupted(import_):
+            return None
+        return import_
+
+    async def _fail_interrupted(self, import_: dict) -> bool:
+        if import_["status"] not in (ImportStatus.pending, ImportStatus.processing):
+            return False
+        try:
+            if await redis_client.exists(self._get_heartbeat_key(import_["id"])):
+                return False
+        except RedisError:
+            return False
+        interrupted = await self.queries.update(
+            filters={
+                "id": import_["id"],
+                "status__in": [ImportStatus.pending, ImportStatus.processing],
+                "created__lt": func.now() - cast(timedelta(seconds=self.HEARTBEAT_TTL), Interval),
+            },
+            values={"status": ImportStatus.failed, "finished": func.now(), "error": "Import was interrupted"},
+        )
+        return interrupted is not None
 
     @classmethod
-    async def _create_missing_teams(cls, teams: set[str]):
-        teams_db = await TeamManager().queries.get_entities(
-            filters={"name__in": teams, "project_id": PROJECT_ID.get()}, return_fields={"name"}
+    def _replay(cls, import_: dict) -> ImportResult:
+        if import_["status"] != ImportStatus.finished:
+            raise ConflictException(detail="Import with the same Idempotency-Key is running")
+        return cls._get_result(import_)
+
+    async def _get_replayed(self, idempotency_key: str | None) -> ImportResult | None:
+        if (import_ := await self._get_by_idempotency_key(idempotency_key)) is None:
+            return None
+        return self._replay(import_)
+
+    async def _create(self, **values) -> tuple[dict, bool]:
+        """Create a pending import, or return the import which took its idempotency key concurrently and False."""
+        while (import_ := await self.queries.create_unless_key_taken(status=ImportStatus.pending, **values)) is None:
+            if (taken := await self._get_by_idempotency_key(values["idempotency_key"])) is not None:
+                return taken, False
+        await redis_client.set(self._get_progress_key(import_["id"]), 0, ex=self.PROGRESS_TTL)
+        await self._beat(import_["id"])
+        return import_, True
+
+    async def _get_duplicate(self, content_hash: str, mode: ImportMode) -> dict | None:
+        """The finished import of the same file, as long as no import has changed data since."""
+        return await self.queries.get_duplicate(PROJECT_ID.get(), content_hash, mode, ImportStatus.finished)
+
+    async def create(
+        self, file: UploadFile, mode: ImportMode = ImportMode.create, idempotency_key: str | None = None
+    ) -> ImportResult:
+        if (result := await self._get_replayed(idempotency_key)) is not None:
+            return result
+        content_hash = await asyncio.get_running_loop().run_in_executor(None, hash_file, file.file)
+        if (duplicate := await self._get_duplicate(content_hash, mode)) is not None:
+            return self._get_result(duplicate)
+
+        import_, is_created = await self._create(
+            filename=file.filename, mode=mode, content_hash=content_hash, idempotency_key=idempotency_key
+        )
+        if not is_created:
+            return self._replay(import_)
+        chunks = read_upload(file, self.validator.block_size)
+        return await self._run(import_["id"], chunks, mode, self.get_upload_format(file))
+
+    async def create_from_stream(
+        self,
+        chunks: AsyncIterable[bytes],
+        filename: str,
+        mode: ImportMode = ImportMode.create,
+        import_format: ImportFormat = ImportFormat.csv,
+        idempotency_key: str | None = None,
+    ) -> ImportResult:
+        if (result := await self._get_replayed(idempotency_key)) is not None:
+            return result
+        import_, is_created = await self._create(filename=filename, mode=mode, idempotency_key=idempotency_key)
+        if not is_created:
+            return self._replay(import_)
+        digest = hashlib.sha256()
+        result = await self._run(import_["id"], hash_chunks(chunks, digest), mode, import_format)
+        await self._update(import_["id"], content_hash=digest.hexdigest())
+        return result
+
+    async def create_job(
+        self, file: UploadFile, mode: ImportMode = ImportMode.create, idempotency_key: str | None = None
+    ) -> dict:
+        if (import_ := await self._get_by_idempotency_key(idempotency_key)) is not None:
+            return await self.get_job(import_["id"])
+        path, content_hash = await asyncio.get_running_loop().run_in_executor(
+            None, spool_file, file.file, ImportConfig.get_default().spool_dir
         )
-        team_names_db = [team["name"] for team in teams_db]
-        missing_teams = [team for team in teams if team not in team_names_db]
-        await TeamManager().create(missing_teams)
-        teams_db = await TeamManager().queries.get_entities(
-            filters={"name__in": teams, "project_id": PROJECT_ID.get()}, return_fields={"name", "id"}
+        try:
+            if (duplicate := await self._get_duplicate(content_hash, mode)) is None:
+                import_, is_created = await self._create(
+                    filename=file.filename, mode=mode, content_hash=content_hash, idempotency_key=idempotency_key
+                )
+                if not is_created:
+                    duplicate = import_
+        except BaseException:
+            os.unlink(path)
+            raise
+        if duplicate is not None:
+            os.unlink(path)
+            return await self.get_job(duplicate["id"])
+        task = asyncio.create_task(
+            self._run_job(
+                PROJECT_ID.get(), import_["id"], path, import_["filename"], mode, self.get_upload_format(file)
+            ),
+            context=contextvars.Context(),
         )
-        return {team["name"]: team["id"] for team in teams_db}
+        self._jobs.add(task)
+        task.add_done_callback(self._jobs.discard)
+        return import_
+
+    async def get_job(self, import_id: int) -> dict:
+        import_ = await self.queries.get_entity(filters={"id": import_id, "project_id": PROJECT_ID.get()})
+        if import_ is None:
+            raise NotFoundException(detail="Import not found")
+        rows_processed = await redis_client.get(self._get_progress_key(import_id))
+        return {**import_, "rows_processed": rows_processed and int(rows_processed)}
+
+    @classmethod
+    async def cancel_jobs(cls):
+        for task in cls._jobs:
+            task.cancel()
+        await asyncio.gather(*cls._jobs, return_exceptions=True)
+
+    async def _run_job(
+        self, project_id: int, import_id: int, path: str, filename: str, mode: ImportMode, import_format: ImportFormat
+    ):
+        PROJECT_ID.set(project_id)
+        try:
+            with open(path, "rb") as file:
+                chunks = read_upload(UploadFile(file, filename=filename), self.validator.block_size)
+                await self._run(import_id, chunks, mode, import_format)
+        except HTTPException:
+            pass  # already recorded in the job
+        except Exception:
+            logger.exception("Import %s failed", import_id)
+            await self.queries.update(
+                filters={"id": import_id, "status__in": [ImportStatus.pending, ImportStatus.processing]},
+                values={"status": ImportStatus.failed, "finished": func.now(), "error": "Internal error"},
+                is_returning=False,
+            )
+        finally:
+            os.unlink(path)
+
+    async def _run(
+        self, import_id: int, chunks: AsyncIterable[bytes], mode: ImportMode, import_format: ImportFormat
+    ) -> ImportResult:
+        await self._update(import_id, status=ImportStatus.processing, started=func.now())
+        heartbeat = asyncio.create_task(self._keep_beating(import_id))
+        try:
+            return await self._import(import_id, chunks, mode, import_format)
+        except HTTPException as e:
+            await self._update(import_id, status=ImportStatus.failed, finished=func.now(), error=e.detail)
+            raise
+        except BaseException:
+            await self._update(import_id, status=ImportStatus.failed, finished=func.now(), error="Internal error")
+            raise
+        finally:
+            heartbeat.cancel()
+
+    async def _beat(self, import_id: int):
+        await redis_client.set(self._get_heartbeat_key(import_id), 1, ex=self.HEARTBEAT_TTL)
+
+    async def _keep_beating(self, import_id: int):
+        while True:
+            await asyncio.sleep(self.HEARTBEAT_TTL / 3)
+            try:
+                await self._beat(import_id)
+            except RedisError:
+                pass  # the next beat may succeed before the heartbeat expires
+
+    async def _import(
+        self, import_id: int, chunks: AsyncIterable[bytes], mode: ImportMode, import_format: ImportFormat
+    ) -> ImportResult:
+        resolved_team_ids, locked_team_ids, updated_team_ids, counts = {}, set(), set(), Counter()
+        touched_buckets = {bucket: set() for bucket in TeamDataManager().get_rollup_buckets()}
+        data_version = None
+        try:
+            async with self._get_lock() as lock:
+                async with get_database().transaction():
+                    if mode == ImportMode.upsert:
+                        await TeamDataManager().track_keys()
+                    async with aclosing(self.validator.validate_create(chunks, import_format)) as batches:
+                        async for batch in batches:
+                            team_ids = await self._get_team_ids(batch.teams, resolved_team_ids)
+                            if self.lock_scope == ImportLockScope.team:
+                                await self._lock_teams({team_ids[name] for name in batch.teams}, locked_team_ids)
+                            batch = batch.with_team_ids(team_ids)
+                            inserted, updated, updated_teams = await self._write(batch, import_id, mode)
+                            counts.update(rows=len(batch), inserted=inserted, updated=updated)
+                            updated_team_ids |= updated_teams
+                            for bucket, touched in touched_buckets.items():
+                                touched |= batch.get_buckets(bucket)
+                            await redis_client.incrby(self._get_progress_key(import_id), len(batch))
+                    if updated_team_ids:
+                        await TeamDataManager().recompute_stats(updated_team_ids, import_id)
+                    await TeamDataManager().refresh_rollups(touched_buckets)
+                    if counts["inserted"] or counts["updated"]:  # unchanged data keeps cached responses valid
+                        data_version = await ProjectManager().bump_data_version(PROJECT_ID.get())
+                    result = ImportResult(
+                        inserted=counts["inserted"],
+                        updated=counts["updated"],
+                        unchanged=counts["rows"] - counts["inserted"] - counts["updated"],
+                    )
+                    await self._update(import_id, status=ImportStatus.finished, finished=func.now(), **result.dict())
+                    if lock is not None:
+                        lock.stop_cancelling()  # a commit which is cut off may still have been applied
+        except ForeignKeyViolationError:  # a cached team doesn't exist anymore
+            TeamIdsCache().invalidate(PROJECT_ID.get())
+            raise
+        except LockError:
+            raise ConflictException(detail="Another import of the project is running")
+        except DeadlockDetectedError:
+            raise ConflictException(detail="Import conflicts with a concurrent import of the same teams")
+        TeamIdsCache().update(PROJECT_ID.get(), resolved_team_ids)
+        if data_version is not None:
+            await ProjectManager().publish_data_version(PROJECT_ID.get(), data_version)
+        return result
+
+    @staticmethod
+    async def _lock_teams(team_ids: set[int], locked: set[int]):
+        if team_ids := team_ids - locked:
+            await TeamDataManager().lock_teams(team_ids)
+            locked |= team_ids
+
+    async def _update(self, import_id: int, **values):
+        if "error" in values:
+            values["error"] = jsonable_encoder(values["error"])
+        await self.queries.update(filters={"id": import_id}, values=values, is_returning=False)
+
+    @staticmethod
+    async def _write(batch: TeamMetricBatch, import_id: int, mode: ImportMode) -> tuple[int, int, set[int]]:
+        if mode == ImportMode.upsert:
+            inserted, updated, updated_teams, repeated = await TeamDataManager().upsert(batch, import_id)
+            if repeated:
+                raise BadRequestException(ImportErrors.duplicated_data)
+            return inserted, updated, updated_teams
+        await TeamDataManager().create(batch, import_id)
+        return len(batch), 0, set()
+
+    @staticmethod
+    async def _get_team_ids(teams: set[str], resolved: dict[str, int]) -> dict[str, int]:
+        """Look teams up in the cache, then among ids resolved earlier in this import, then in the database."""
+        team_ids, missing = TeamIdsCache().get(PROJECT_ID.get(), teams)
+        if missing := missing - resolved.keys():
+            resolved |= await TeamManager().get_or_create_ids(missing)
+        return team_ids | resolved
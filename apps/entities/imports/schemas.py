@@ -1,13 +1,62 @@
 import datetime
+from enum import Enum
+from enum import unique
+from typing import Any
 
 from pydantic import conint
 from pydantic import constr
+from pydantic import NonNegativeInt
 
+from core.types import EntityId
 from core.utils import ImmutableModel
 
 
+@unique
+class ImportMode(str, Enum):
+    create = "create"  # fails on rows which already exist
+    upsert = "upsert"  # updates existing rows, unchanged rows are not written
+
+
+@unique
+class ImportFormat(str, Enum):
+
+    csv = "text/csv"
+    parquet = "application/vnd.apache.parquet"
+    arrow_file = "application/vnd.apache.arrow.file"
+    arrow_stream = "application/vnd.apache.arrow.stream"
+
+
+@unique
+class ImportStatus(str, Enum):
+    pending = "pending"
+    processing = "processing"
+    finished = "finished"
+    failed = "failed"
+
+
 class TeamMetricCSV(ImmutableModel):
-    review_time: conint(ge=0)
+    review_time: conint(ge=0, le=2147483647)  # INTEGER columns of `team_data`
     team: constr(min_length=1, max_length=255)
     date: datetime.date
-    merge_time: conint(ge=0)
+    merge_time: conint(ge=0, le=2147483647)
+
+
+class ImportResult(ImmutableModel):
+    inserted: NonNegativeInt = 0
+    updated: NonNegativeInt = 0
+    unchanged: NonNegativeInt = 0
+
+
+class ImportJob(ImmutableModel):
+    id: EntityId
+    filename: str
+    mode: ImportMode
+    status: ImportStatus
+    rows_processed: NonNegativeInt | None = None  # progress of a running import
+    inserted: NonNegativeInt | None
+    updated: NonNegativeInt | None
+    unchanged: NonNegativeInt | None
+    error: Any = None
+    created: datetime.datetime
+    started: datetime.datetime | None
+    finished: datetime.datetime | None
@@ -1,12 +1,42 @@
+import asyncio
+import datetime
+import io
+import operator
+import tempfile
+import zlib
+from collections import deque
+from collections.abc import AsyncIterable
+from collections.abc import AsyncIterator
+from collections.abc import Callable
+from collections.abc import Iterator
 from enum import Enum
 from enum import unique
 
+import numpy
 import pandas
 from fastapi import UploadFile
+from pydantic import ValidationError
+from pydantic.fields import ModelField
 
 from apps.entities.base import BaseValidator
+from apps.entities.imports.schemas import ImportFormat
 from apps.entities.imports.schemas import TeamMetricCSV
+from apps.entities.teams.schemas import TeamMetricBatch
 from core.exceptions import BadRequestException
+from core.exceptions import UnsupportedMediaTypeException
+from core.settings import ImportConfig
+from core.settings import ImportExecutor
+from core.utils import get_process_pool
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # columnar import formats are accepted only if the optional `pyarrow` is installed
+    pyarrow = None
+
+ColumnErrors = list[tuple[pandas.Series, str]]
 
 
 @unique
@@ -15,6 +45,7 @@ class ImportErrors(Enum):
     missing_columns = "Missing columns in file"
     duplicated_data = "File contains duplicates"
     empty_file = "Empty file"
+    invalid_column_types = "Invalid column types"
 
 
 @unique
@@ -25,26 +56,334 @@ class ImportFileColumns(Enum):
     merge_time = "merge_time"
 
 
+def check_values(values: pandas.Series, field: ModelField) -> tuple[pandas.Series, ColumnErrors]:
+    parsed, messages = [], []
+    for value in values.tolist():
+        value, error = field.validate(value, {}, loc=field.name)
+        parsed.append(value)
+        messages.append(error and ValidationError([error], TeamMetricCSV).errors()[0]["msg"])
+    messages = pandas.Series(messages, index=values.index, dtype=object)
+    return pandas.Series(parsed, index=values.index, dtype=object), [
+        (messages == message, message) for message in messages.dropna().unique()
+    ]
+
+
+def merge_checked(
+    values: pandas.Series, parsed: pandas.Series, slow: pandas.Series, field: ModelField
+) -> tuple[pandas.Series, ColumnErrors]:
+    if not slow.any():
+        return values, []
+    checked, errors = check_values(parsed[slow], field)
+    valid = pandas.Series(True, index=checked.index)
+    for mask, _ in errors:
+        valid &= ~mask
+    values = values.copy()
+    values[valid[valid].index] = numpy.array(checked[valid].tolist(), dtype=values.dtype)
+    return values, [(mask.reindex(values.index, fill_value=False), message) for mask, message in errors]
+
+
+def check_int_column(values: pandas.Series, field: ModelField) -> tuple[pandas.Series, ColumnErrors]:
+    if pandas.api.types.is_integer_dtype(values.dtype):
+        fast = values <= numpy.iinfo(numpy.int64).max
+    elif pandas.api.types.is_float_dtype(values.dtype):
+        fast = values.notna() & (values % 1 == 0) & (values.abs() <= 2**53)  # floats which are exact integers
+    else:
+        fast = values.str.fullmatch(r"\d{1,18}").fillna(False).astype(bool)
+    numbers = values.where(fast, 0).astype("int64")
+    errors = []
+    for limit, compare, message in (
+        ("gt", operator.le, "ensure this value is greater than {}"),
+        ("ge", operator.lt, "ensure this value is greater than or equal to {}"),
+        ("lt", operator.ge, "ensure this value is less than {}"),
+        ("le", operator.gt, "ensure this value is less than or equal to {}"),
+    ):
+        if (bound := getattr(field.type_, limit, None)) is not None:
+            errors.append((fast & compare(numbers, bound), message.format(bound)))
+    numbers, slow_errors = merge_checked(numbers, values, ~fast, field)
+    return numbers.astype("int64"), errors + slow_errors
+
+
+def check_str_column(values: pandas.Series, field: ModelField) -> tuple[pandas.Series, ColumnErrors]:
+    missing = values.isna()
+    values = values.fillna("").astype(str)
+    errors = [(missing, "none is not an allowed value")]
+    if min_length := getattr(field.type_, "min_length", None):
+        errors.append(
+            (~missing & (values.str.len() < min_length), f"ensure this value has at least {min_length} characters")
+        )
+    if max_length := getattr(field.type_, "max_length", None):
+        errors.append((values.str.len() > max_length, f"ensure this value has at most {max_length} characters"))
+    return values, errors
+
+
+def check_date_column(values: pandas.Series, field: ModelField) -> tuple[pandas.Series, ColumnErrors]:
+    dates = pandas.Series(pandas.NaT, index=values.index, dtype="datetime64[s]")  # not bound to 1677-2262 like ns
+    fast = pandas.Series(False, index=values.index)
+    if values.dtype == object:  # anything else, e.g. numbers as timestamps, is parsed by the field
+        fast = values.str.fullmatch(r"(?!0000)\d{4}-\d{2}-\d{2}").fillna(False).astype(bool)
+        try:
+            dates[fast] = numpy.array(values[fast].tolist(), dtype="datetime64[D]").astype(dates.dtype)
+        except ValueError:  # e.g. a day out of the month, the whole block is parsed by the field to find it
+            fast[:] = False
+    return merge_checked(dates, values, ~fast, field)
+
+
+class ChunkError(Exception):
+    def __init__(self, detail: ImportErrors | list[dict]):
+        super().__init__(detail)
+        self.detail = detail
+
+
+def get_column_check(field: ModelField) -> Callable[[pandas.Series, ModelField], tuple[pandas.Series, ColumnErrors]]:
+    if issubclass(field.type_, int):
+        return check_int_column
+    if issubclass(field.type_, str):
+        return check_str_column
+    if issubclass(field.type_, datetime.date):
+        return check_date_column
+    raise NotImplementedError(f"Unable to validate {field.name} column of type {field.type_}")
+
+
+COLUMN_CHECKS = {name: get_column_check(field) for name, field in TeamMetricCSV.__fields__.items()}
+
+
+def parse_chunk(header: bytes, data: bytes, max_errors: int) -> TeamMetricBatch:
+    try:
+        df = pandas.read_csv(io.BytesIO(header + data), dtype={ImportFileColumns.team.value: str})
+    except Exception:
+        raise ChunkError(ImportErrors.invalid_file)
+    for f in ImportFileColumns:
+        if f.value not in df.columns:
+            raise ChunkError(ImportErrors.missing_columns)
+    if df[[ImportFileColumns.date.value, ImportFileColumns.team.value]].duplicated().any():
+        raise ChunkError(ImportErrors.duplicated_data)
+
+    errors = []
+    for name, check in COLUMN_CHECKS.items():
+        df[name], column_errors = check(df[name], TeamMetricCSV.__fields__[name])
+        for mask, message in column_errors:
+            errors.extend(
+                {"row": row + 1, "column": name, "message": message} for row in df.index[mask][:max_errors].tolist()
+            )
+    if errors:
+        raise ChunkError(sorted(errors, key=operator.itemgetter("row"))[:max_errors])
+
+    team_codes, team_names = pandas.factorize(df[ImportFileColumns.team.value])
+    return TeamMetricBatch(
+        team_names=team_names.tolist(),
+        team_codes=team_codes.astype("int32"),
+        date=df[ImportFileColumns.date.value].to_numpy(dtype="datetime64[D]"),
+        review_time=df[ImportFileColumns.review_time.value].to_numpy(dtype="int64"),
+        merge_time=df[ImportFileColumns.merge_time.value].to_numpy(dtype="int64"),
+    )
+
+
+def check_arrow_int_column(values: "pyarrow.Array", field: ModelField) -> tuple[numpy.ndarray, ColumnErrors]:
+    if not pyarrow.types.is_integer(values.type):
+        raise ChunkError(ImportErrors.invalid_column_types)
+    numbers, errors = check_int_column(values.to_pandas(), field)
+    return numbers.to_numpy(), [(mask.to_numpy(), message) for mask, message in errors]
+
+
+def check_arrow_str_column(values: "pyarrow.Array", field: ModelField) -> tuple["pyarrow.Array", ColumnErrors]:
+    if pyarrow.types.is_dictionary(values.type):
+        values = values.dictionary_decode()
+    if not (pyarrow.types.is_string(values.type) or pyarrow.types.is_large_string(values.type)):
+        raise ChunkError(ImportErrors.invalid_column_types)
+    missing = values.is_null().to_numpy(zero_copy_only=False)
+    lengths = pyarrow.compute.utf8_length(values).fill_null(0).to_numpy()
+    errors = [(missing, "none is not an allowed value")]
+    if min_length := getattr(field.type_, "min_length", None):
+        errors.append((~missing & (lengths < min_length), f"ensure this value has at least {min_length} characters"))
+    if max_length := getattr(field.type_, "max_length", None):
+        errors.append((lengths > max_length, f"ensure this value has at most {max_length} characters"))
+    return values, errors
+
+
+def check_arrow_date_column(values: "pyarrow.Array", field: ModelField) -> tuple[numpy.ndarray, ColumnErrors]:
+    if not (pyarrow.types.is_date(values.type) or pyarrow.types.is_timestamp(values.type)):
+        raise ChunkError(ImportErrors.invalid_column_types)
+    dates = values.cast(pyarrow.date32()).to_numpy(zero_copy_only=False)
+    return dates, [(numpy.isnat(dates), "invalid date format")]
+
+
+def get_arrow_column_check(field: ModelField) -> Callable:
+    return {
+        check_int_column: check_arrow_int_column,
+        check_str_column: check_arrow_str_column,
+        check_date_column: check_arrow_date_column,
+    }[get_column_check(field)]
+
+
+ARROW_COLUMN_CHECKS = {name: get_arrow_column_check(field) for name, field in TeamMetricCSV.__fields__.items()}
+
+
+def read_record_batches(path: str, import_format: ImportFormat, batch_rows: int) -> Iterator["pyarrow.RecordBatch"]:
+    columns = [column.value for column in ImportFileColumns]
+    try:
+        data = pyarrow.memory_map(path)
+        if import_format == ImportFormat.parquet:
+            file = pyarrow.parquet.ParquetFile(data)
+            if not set(columns) <= set(file.schema_arrow.names):
+                raise ChunkError(ImportErrors.missing_columns)
+            yield from file.iter_batches(batch_size=batch_rows, columns=columns)
+            return
+        if import_format == ImportFormat.arrow_file:
+            table = pyarrow.ipc.open_file(data).read_all()
+        else:
+            table = pyarrow.ipc.open_stream(data).read_all()
+        if not set(columns) <= set(table.schema.names):
+            raise ChunkError(ImportErrors.missing_columns)
+        yield from table.select(columns).to_batches(max_chunksize=batch_rows)
+    except pyarrow.ArrowException:
+        raise ChunkError(ImportErrors.invalid_file)
+
+
+def parse_record_batch(record_batch: "pyarrow.RecordBatch", max_errors: int) -> TeamMetricBatch:
+    columns, errors = {}, []
+    for name, check in ARROW_COLUMN_CHECKS.items():
+        columns[name], column_errors = check(record_batch.column(name), TeamMetricCSV.__fields__[name])
+        for mask, message in column_errors:
+            errors.extend(
+                {"row": row + 1, "column": name, "message": message}
+                for row in numpy.flatnonzero(mask)[:max_errors].tolist()
+            )
+    if errors:
+        raise ChunkError(sorted(errors, key=operator.itemgetter("row"))[:max_errors])
+
+    teams = pyarrow.compute.dictionary_encode(columns[ImportFileColumns.team.value])
+    team_codes = teams.indices.to_numpy().astype("int32")
+    date = columns[ImportFileColumns.date.value].astype("datetime64[D]")
+    if numpy.unique(TeamMetricBatch.pack_keys(team_codes, date)).size != len(date):
+        raise ChunkError(ImportErrors.duplicated_data)
+    return TeamMetricBatch(
+        team_names=teams.dictionary.to_pylist(),
+        team_codes=team_codes,
+        date=date,
+        review_time=columns[ImportFileColumns.review_time.value].astype("int64"),
+        merge_time=columns[ImportFileColumns.merge_time.value].astype("int64"),
+    )
+
+
+async def read_upload(file: UploadFile, size: int) -> AsyncIterator[bytes]:
+    while chunk := await file.read(size):
+        yield chunk
+
+
+async def read_gzip(chunks: AsyncIterable[bytes], size: int) -> AsyncIterator[bytes]:
+    """Decompress a gzip stream as it arrives, in pieces of at most `size` bytes however well the data compresses."""
+    decompressor = zlib.decompressobj(wbits=31)  # 31 is the gzip container
+    try:
+        async for chunk in chunks:
+            while chunk:
+                if data := decompressor.decompress(chunk, size):
+                    yield data
+                chunk = decompressor.unconsumed_tail
+        if not decompressor.eof:
+            raise zlib.error("Truncated stream")
+    except zlib.error:
+        raise BadRequestException(ImportErrors.invalid_file)
+
+
+async def read_lines_blocks(chunks: AsyncIterable[bytes], size: int) -> AsyncIterator[bytes]:
+    """Regroup a byte stream into blocks of whole lines of at least `size` bytes (except the last one)."""
+    parts, length = [], 0
+    async for chunk in chunks:
+        parts.append(chunk)
+        length += len(chunk)
+        if length >= size and (end := chunk.rfind(b"\n")) != -1:
+            rest = chunk[end + 1 :]
+            parts[-1] = chunk[: end + 1]
+            yield b"".join(parts)
+            parts, length = [rest], len(rest)
+    if block := b"".join(parts):
+        yield block
+
+
 class ImportValidator(BaseValidator):
-    async def validate_create(self, file: UploadFile) -> tuple[list[TeamMetricCSV], set[str]]:
+    block_size: int = ImportConfig.get_default().block_size
+    max_errors: int = ImportConfig.get_default().max_errors
+    executor: ImportExecutor = ImportConfig.get_default().executor
+    workers: int = ImportConfig.get_default().workers
+    batch_rows: int = ImportConfig.get_default().batch_rows
+
+    async def validate_create(
+        self, chunks: AsyncIterable[bytes], import_format: ImportFormat = ImportFormat.csv
+    ) -> AsyncIterator[TeamMetricBatch]:
+        """Parse and validate the file block by block, so memory is bounded by `block_size` * `workers`."""
+        if import_format == ImportFormat.csv:
+            parsed = self._parse_csv(chunks)
+        else:
+            parsed = self._parse_columnar(chunks, import_format)
+
+        pending, rows = deque(), 0
         try:
-            df = pandas.read_csv(file.file)
-        except Exception:
+            async for future in parsed:
+                pending.append(future)
+                if len(pending) > self.workers:
+                    batch = await self._get_batch(pending.popleft(), rows)
+                    rows += len(batch)
+                    yield batch
+            while pending:
+                batch = await self._get_batch(pending.popleft(), rows)
+                rows += len(batch)
+                yield batch
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def _parse_csv(self, chunks: AsyncIterable[bytes]) -> AsyncIterator[asyncio.Future]:
+        blocks = read_lines_blocks(chunks, self.block_size)
+        header, _, first_block = (await anext(blocks, b"")).partition(b"\n")
+        if not header.strip():
             raise BadRequestException(ImportErrors.invalid_file)
-        for f in ImportFileColumns:
-            if f.value not in df.columns:
-                raise BadRequestException(ImportErrors.missing_columns)
-        if df[[ImportFileColumns.date.value, ImportFileColumns.team.value]].duplicated().any():
-            raise BadRequestException(ImportErrors.duplicated_data)
-        if len(df) == 0:
+        header += b"\n"
+
+        if first_block:
+            yield asyncio.ensure_future(self._parse(header, first_block))
+        is_empty = not first_block
+        async for block in blocks:
+            is_empty = False
+            yield asyncio.ensure_future(self._parse(header, block))
+        if is_empty:
+            # header is still validated for files without rows
+            await self._get_batch(asyncio.ensure_future(self._parse(header, b"")), 0)
             raise BadRequestException(ImportErrors.empty_file)
-        results, teams = [], set()
-        for row in df.to_dict("records"):
+
+    async def _parse_columnar(
+        self, chunks: AsyncIterable[bytes], import_format: ImportFormat
+    ) -> AsyncIterator[asyncio.Future]:
+        if pyarrow is None:
+            raise UnsupportedMediaTypeException(detail=f"{import_format.value} requires pyarrow")
+        loop = asyncio.get_running_loop()
+        with tempfile.NamedTemporaryFile(dir=ImportConfig.get_default().spool_dir, prefix="import-") as file:
+            async for chunk in chunks:
+                await loop.run_in_executor(None, file.write, chunk)
+            await loop.run_in_executor(None, file.flush)
+            record_batches = read_record_batches(file.name, import_format, self.batch_rows)
+            is_empty = True
             try:
-                entry = TeamMetricCSV(**row)  # pydantic might be slow, so we can validate with another library
-            except Exception as e:
-                raise BadRequestException(f"Unable to process data: {str(e)}")
-            teams.add(entry.team)
-            results.append(entry)
+                while (record_batch := await loop.run_in_executor(None, next, record_batches, None)) is not None:
+                    is_empty = False
+                    # Arrow kernels release the GIL, so threads are enough
+                    yield loop.run_in_executor(None, parse_record_batch, record_batch, self.max_errors)
+            except ChunkError as e:
+                raise BadRequestException(e.detail)
+        if is_empty:
+            raise BadRequestException(ImportErrors.empty_file)
+
+    async def _parse(self, header: bytes, block: bytes) -> TeamMetricBatch:
+        if self.executor == ImportExecutor.inline:
+            return parse_chunk(header, block, self.max_errors)
+        return await asyncio.get_running_loop().run_in_executor(
+            get_process_pool(self.workers), parse_chunk, header, block, self.max_errors
+        )
 
-        return results, teams
+    @staticmethod
+    async def _get_batch(future: asyncio.Future, rows: int) -> TeamMetricBatch:
+        try:
+            return await future
+        except ChunkError as e:
+            if isinstance(e.detail, ImportErrors):
+                raise BadRequestException(e.detail)
+            raise BadRequestException([{**error, "row": error["row"] + rows} for error in e.detail])
@@ -0,0 +1,31 @@
+from core.utils import Singleton
+
+
+class ProjectIdsCache(metaclass=Singleton):
+    """In-process set of ids of existing projects, which every request is checked against."""
+
+    def __init__(self):
+        self._ids: frozenset[int] | None = None
+        self.generation = 0  # incremented by every announced change
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._ids is not None
+
+    def __contains__(self, project_id: int) -> bool:
+        return project_id in self._ids
+
+    def set(self, ids: list[int], generation: int):
+        if generation == self.generation:
+            self._ids = frozenset(ids)
+
+    def add(self, project_id: int):
+        if self._ids is not None:
+            self._ids |= {project_id}
+
+    def expire(self):
+        self.generation += 1
+
+    def invalidate(self):
+        self.expire()
+        self._ids = None
@@ -0,0 +1,112 @@
+import asyncio
+import contextvars
+from contextlib import suppress
+
+from redis.exceptions import RedisError
+
+from apps.entities.base import BaseManager
+from apps.entities.projects.cache import ProjectIdsCache
+from core.redis import redis_client
+from db.models import project
+from db.queries.project import ProjectQuery
+
+# versions only grow, so a stale value written late by a slow reader or importer never replaces a newer one
+SET_MAX_SCRIPT = redis_client.register_script(
+    """
+    local current = tonumber(redis.call('GET', KEYS[1]))
+    local version = tonumber(ARGV[1])
+    if current == nil or current < version then
+        redis.call('SET', KEYS[1], version, 'EX', ARGV[2])
+        return version
+    end
+    return current
+    """
+)
+
+PROJECTS_CHANNEL = "project:changes"
+
+
+class ProjectManager(BaseManager):
+    queries: ProjectQuery = ProjectQuery
+    table_model = project
+
+    DATA_VERSION_TTL = 60  # seconds, a version which failed to be published is read from the database after it
+    LISTEN_RETRY_DELAY = 1  # seconds before subscribing again once Redis has failed
+    _listener: asyncio.Task | None = None
+
+    async def is_exists(self, project_id: int) -> bool:
+        while not ProjectIdsCache().is_loaded:
+            await self.load_ids()
+        return project_id in ProjectIdsCache()
+
+    async def load_ids(self):
+        cache = ProjectIdsCache()
+        generation = cache.generation
+        cache.set(await self.queries.get_entities_ids(), generation)
+
+    async def create(self, name: str) -> dict:
+        project_ = await self.queries.create(name=name)
+        ProjectIdsCache().add(project_["id"])
+        await self.publish_projects_change()
+        return project_
+
+    @staticmethod
+    async def publish_projects_change():
+        with suppress(RedisError):
+            await redis_client.publish(PROJECTS_CHANNEL, "")
+
+    async def listen_projects_changes(self):
+        """Reload ids on every change, and on subscribing as changes may have been missed without a subscription."""
+        while True:
+            try:
+                async with redis_client.pubsub() as pubsub:
+                    await pubsub.subscribe(PROJECTS_CHANNEL)
+                    async for message in pubsub.listen():
+                        if message["type"] in ("subscribe", "message"):
+                            await self._reload_ids()
+            except RedisError:
+                await asyncio.sleep(self.LISTEN_RETRY_DELAY)
+
+    async def _reload_ids(self):
+        ProjectIdsCache().expire()
+        try:
+            await self.load_ids()
+        except Exception:
+            ProjectIdsCache().invalidate()  # the next check loads ids itself
+
+    @classmethod
+    def start_listening(cls):
+        cls._listener = asyncio.create_task(cls().listen_projects_changes(), context=contextvars.Context())
+
+    @classmethod
+    async def stop_listening(cls):
+        if cls._listener is not None:
+            cls._listener.cancel()
+            with suppress(asyncio.CancelledError):
+                await cls._listener
+            cls._listener = None
+
+    @staticmethod
+    def _get_data_version_key(project_id: int) -> str:
+        return f"project:data_version:{project_id}"
+
+    async def get_data_version(self, project_id: int) -> int:
+        with suppress(RedisError):
+            if (version := await redis_client.get(self._get_data_version_key(project_id))) is not None:
+                return int(version)
+        version = await self.queries.get_value("data_version", filters={"id": project_id})
+        await self.publish_data_version(project_id, version)
+        return version
+
+    async def bump_data_version(self, project_id: int) -> int:
+        """Increment the version in the current transaction, publish it once the transaction is committed."""
+        return await self.queries.bump_data_version(project_id)
+
+    async def publish_data_version(self, project_id: int, version: int):
+        """If Redis fails, the outdated version is dropped for readers to fall back to the database, or it expires."""
+        key = self._get_data_version_key(project_id)
+        try:
+            await SET_MAX_SCRIPT(keys=[key], args=[version, self.DATA_VERSION_TTL])
+        except RedisError:
+            with suppress(RedisError):
+                await redis_client.delete(key)
@@ -0,0 +1,23 @@
+from collections import defaultdict
+
+from core.utils import Singleton
+
+
+class TeamIdsCache(metaclass=Singleton):
+    """In-process `name -> id` cache of teams per project."""
+
+    def __init__(self):
+        self._ids: dict[int, dict[str, int]] = defaultdict(dict)
+
+    def get(self, project_id: int, names: set[str]) -> tuple[dict[str, int], set[str]]:
+        cached = self._ids[project_id]
+        return {name: cached[name] for name in names if name in cached}, {name for name in names if name not in cached}
+
+    def update(self, project_id: int, ids: dict[str, int]):
+        self._ids[project_id].update(ids)
+
+    def invalidate(self, project_id: int | None = None):
+        if project_id is None:
+            self._ids.clear()
+        else:
+            self._ids.pop(project_id, None)
@@ -1,18 +1,115 @@
+import datetime
+from collections.abc import AsyncIterator
+
 from apps.entities.base import BaseManager
-from apps.entities.teams.schemas import TeamMetricCreate
+from apps.entities.teams.schemas import MetricsBucket
+from apps.entities.teams.schemas import TeamData
+from apps.entities.teams.schemas import TeamMetricBatch
+from core.contexts import PROJECT_ID
+from core.exceptions import BadRequestException
+from core.exceptions import NotFoundException
 from db.models import team
 from db.models import team_data
+from db.queries.base import CountMode
+from db.queries.base import Page
+from db.queries.base import ResultMode
+from db.queries.team import TeamQuery
+from db.queries.team_data import TeamDataQuery
 
 
 class TeamManager(BaseManager):
+    queries: TeamQuery = TeamQuery
     table_model = team
 
-    async def create(self, names: list[str]):
-        return await self.queries.bulk_create([{"name": name} for name in names])
+    async def get_or_create_ids(self, names: set[str]) -> dict[str, int]:
+        return await self.queries.get_or_create_ids(names)
 
 
 class TeamDataManager(BaseManager):
+    queries: TeamDataQuery = TeamDataQuery
     table_model = team_data
 
-    async def create(self, entities: list[TeamMetricCreate]):
-        return await self.queries.bulk_create([entity.dict() for entity in entities])
+    async def create(self, batch: TeamMetricBatch, import_id: int):
+        columns = batch.as_columns()
+        await self.queries.copy_columns(columns)
+        await self.queries.add_stats(columns, import_id)
+
+    async def lock_teams(self, team_ids: set[int]):
+        await self.queries.lock_teams(team_ids)
+
+    async def track_keys(self):
+        await self.queries.create_import_keys()
+
+    async def upsert(self, batch: TeamMetricBatch, import_id: int) -> tuple[int, int, set[int], int]:
+        return await self.queries.upsert_columns(batch.as_columns(), import_id)
+
+    def get_rollup_buckets(self) -> tuple[str, ...]:
+        return tuple(self.queries.rollups)
+
+    async def refresh_rollups(self, buckets: dict[str, set[tuple[int, datetime.date]]]):
+        await self.queries.refresh_rollups(buckets)
+
+    async def recompute_stats(self, team_ids: set[int], import_id: int):
+        await self.queries.recompute_stats(team_ids, import_id)
+
+    async def get_aggregates(
+        self,
+        date_from: datetime.date,
+        date_to: datetime.date,
+        bucket: MetricsBucket,
+        team_ids: list[int] | None = None,
+    ) -> list[dict]:
+        if date_from > date_to:
+            raise BadRequestException("date_from must not be later than date_to")
+        filters = {"project_id": PROJECT_ID.get()}
+        if team_ids:
+            filters["team_id__in"] = team_ids
+        return await self.queries.get_aggregates(date_from, date_to, bucket.value, filters=filters)
+
+    async def get_summary(self, team_id: int) -> dict:
+        stats = await self.queries.stats.get_entity(filters={"team_id": team_id, "project_id": PROJECT_ID.get()})
+        if stats is None:
+            raise NotFoundException(detail="Team has no data")
+        for metric in self.queries.stats.METRICS:
+            stats[f"{metric}_avg"] = stats[f"{metric}_sum"] / stats["rows_count"]
+        return stats
+
+    async def get_page(
+        self,
+        limit: int,
+        cursor: str | None = None,
+        count_mode: CountMode = CountMode.none,
+        date_from: datetime.date | None = None,
+        date_to: datetime.date | None = None,
+        team_ids: list[int] | None = None,
+    ) -> Page:
+        return await self.queries.get_entities_page(
+            limit=limit,
+            cursor=cursor,
+            count_mode=count_mode,
+            filters=self._get_data_filters(date_from, date_to, team_ids),
+            order_by=["team_id", "date"],  # `team_data_unique`, so pages are index range scans
+            return_fields=TeamData.__fields__,
+        )
+
+    def iterate_export(
+        self,
+        date_from: datetime.date | None = None,
+        date_to: datetime.date | None = None,
+        team_ids: list[int] | None = None,
+    ) -> AsyncIterator[list[tuple]]:
+        q = self.queries.get_export_query(filters=self._get_data_filters(date_from, date_to, team_ids))
+        return self.queries.iterate_by_query(q, result_mode=ResultMode.tuple)
+
+    @staticmethod
+    def _get_data_filters(
+        date_from: datetime.date | None, date_to: datetime.date | None, team_ids: list[int] | None
+    ) -> dict:
+        filters = {"project_id": PROJECT_ID.get()}
+        if team_ids:
+            filters["team_id__in"] = team_ids
+        if date_from:
+            filters["date__gte"] = date_from
+        if date_to:
+            filters["date__lte"] = date_to
+        return filters
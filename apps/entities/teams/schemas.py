@@ -1,13 +1,113 @@
+import dataclasses
 import datetime
+from enum import Enum
+from enum import unique
+from typing import ClassVar
 
-from pydantic import conint
+import numpy
+from pydantic import NonNegativeInt
 
 from core.types import EntityId
 from core.utils import ImmutableModel
 
 
-class TeamMetricCreate(ImmutableModel):
-    review_time: conint(ge=0)
+@dataclasses.dataclass(frozen=True, slots=True)
+class TeamMetricBatch:
+    """Chunk of team metrics stored column-wise, one array per column instead of one model per row."""
+
+    columns: ClassVar[tuple[str, ...]] = ("team_id", "date", "review_time", "merge_time")
+    DAY_OFFSET: ClassVar[int] = 1 << 31  # makes days since epoch non-negative, dates before 1970 included
+
+    team_names: list[str]
+    team_codes: numpy.ndarray
+    date: numpy.ndarray  # datetime64[D]
+    review_time: numpy.ndarray
+    merge_time: numpy.ndarray
+    team_id: numpy.ndarray | None = None
+
+    def __len__(self) -> int:
+        return len(self.date)
+
+    @property
+    def teams(self) -> set[str]:
+        return set(self.team_names)
+
+    def with_team_ids(self, team_ids: dict[str, int]) -> "TeamMetricBatch":
+        ids = numpy.fromiter(
+            (team_ids[name] for name in self.team_names), dtype=numpy.int32, count=len(self.team_names)
+        )
+        return dataclasses.replace(self, team_id=ids[self.team_codes])
+
+    def as_columns(self) -> dict[str, numpy.ndarray]:
+        return {column: getattr(self, column) for column in self.columns}
+
+    @classmethod
+    def pack_keys(cls, ids: numpy.ndarray, dates: numpy.ndarray) -> numpy.ndarray:
+        """(id, date) pairs as int64 keys, ids are 32-bit and any date fits the lower 32 bits after the offset."""
+        return ids.astype(numpy.int64) << 32 | (dates.astype("datetime64[D]").astype(numpy.int64) + cls.DAY_OFFSET)
+
+    @classmethod
+    def unpack_keys(cls, keys: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray]:
+        return keys >> 32, ((keys & 0xFFFFFFFF) - cls.DAY_OFFSET).astype("datetime64[D]")
+
+    def get_buckets(self, bucket: str) -> set[tuple[int, datetime.date]]:
+        if bucket == "week":
+            days = self.date.astype(numpy.int64)
+            starts = days - (days + 3) % 7  # 1970-01-01 is a Thursday
+        else:
+            starts = self.date.astype("datetime64[M]").astype("datetime64[D]").astype(numpy.int64)
+        keys = numpy.unique(self.pack_keys(self.team_id, starts.astype("datetime64[D]")))
+        return set(zip(*(column.tolist() for column in self.unpack_keys(keys))))
+
+
+@unique
+class MetricsBucket(str, Enum):
+    day = "day"
+    week = "week"  # ISO weeks, starting on Monday
+    month = "month"
+
+
+class TeamMetricsAggregate(ImmutableModel):
+
+    team_id: EntityId
+    bucket: datetime.date  # first day of the bucket
+    count: NonNegativeInt
+    review_time_avg: float
+    review_time_min: int
+    review_time_max: int
+    review_time_avg_7d: float | None
+    review_time_avg_28d: float | None
+    merge_time_avg: float
+    merge_time_min: int
+    merge_time_max: int
+    merge_time_avg_7d: float | None
+    merge_time_avg_28d: float | None
+
+
+class TeamSummary(ImmutableModel):
+
+    team_id: EntityId
+    rows_count: NonNegativeInt
+    review_time_avg: float
+    review_time_min: int
+    review_time_max: int
+    merge_time_avg: float
+    merge_time_min: int
+    merge_time_max: int
+    first_date: datetime.date
+    last_date: datetime.date
+    last_import_id: EntityId | None
+
+
+class TeamData(ImmutableModel):
     team_id: EntityId
     date: datetime.date
-    merge_time: conint(ge=0)
+    review_time: NonNegativeInt
+    merge_time: NonNegativeInt
+
+
+class TeamDataPage(ImmutableModel):
+    items: list[TeamData]
+    next_cursor: str | None  # pass as `cursor` to get the next page, None on the last page
+    count: NonNegativeInt | None
+    count_is_exact: bool
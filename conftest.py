@@ -3,6 +3,10 @@ import asyncio
 import pytest
 from httpx import AsyncClient
 
+from apps.entities.projects.cache import ProjectIdsCache
+from apps.entities.teams.cache import TeamIdsCache
+from core.redis import redis_client
+from core.utils import shutdown_process_pools
 from db import DatabaseTypeEnum
 from db import get_database
 from db import switch_database
@@ -13,6 +17,7 @@ from services.api.main import app
 def event_loop():
     loop = asyncio.get_event_loop_policy().new_event_loop()
     yield loop
+    shutdown_process_pools()
     loop.close()
 
 
@@ -29,3 +34,7 @@ async def db(event_loop):
     with switch_database(DatabaseTypeEnum.DEFAULT):
         async with get_database() as db:
             yield db
+    TeamIdsCache().invalidate()  # cached teams are rolled back together with the test data
+    ProjectIdsCache().invalidate()  # so are projects
+    if keys := await redis_client.keys("project:data_version:*"):  # so are data versions
+        await redis_client.delete(*keys)
@@ -21,3 +21,7 @@ class NotFoundException(HttpBaseException):
 
 class ConflictException(HttpBaseException):
     status_code = status.HTTP_409_CONFLICT
+
+
+class UnsupportedMediaTypeException(HttpBaseException):
+    status_code = status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
@@ -1,6 +1,11 @@
+import asyncio
+from contextlib import suppress
+
 from redis.asyncio.client import Redis
 from redis.asyncio.connection import BlockingConnectionPool
 from redis.asyncio.lock import Lock
+from redis.exceptions import LockError
+from redis.exceptions import RedisError
 
 from core.settings.redis import RedisConfig
 
@@ -11,7 +16,59 @@ redis_client = Redis(
 )
 
 
+class RenewableLock(Lock):
+    """Lock renewed while its block runs, the block is cancelled if the lock is lost before `stop_cancelling`."""
+
+    retry_delay = 0.1  # seconds between attempts of a failed renewal
+
+    async def __aenter__(self):
+        await super().__aenter__()
+        self._is_cancellable, self._is_cancelled = True, False
+        self._renewal = asyncio.create_task(self._renew(asyncio.current_task()))
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self._renewal.cancel()
+        try:
+            await asyncio.wait([self._renewal])  # unlike awaiting the task, it never raises what the renewal raised
+        finally:
+            with suppress(RedisError):  # a lock which can't be released just expires
+                await super().__aexit__(exc_type, exc_value, traceback)
+        # a cancellation from outside which came along with the one of `_renew` is propagated
+        if self._is_cancelled and not asyncio.current_task().uncancel():
+            raise LockError(f"Lock {self.name} was lost", lock_name=self.name)
+
+    def stop_cancelling(self):
+        """Let the block finish even if the lock is lost from now on, e.g. for a commit which mustn't be cut off."""
+        self._is_cancellable = False
+
+    async def _renew(self, owner: asyncio.Task):
+        while True:
+            await asyncio.sleep(self.timeout / 3)
+            try:
+                async with asyncio.timeout(self.timeout / 3):
+                    await self._reacquire()
+            except (LockError, TimeoutError):
+                if self._is_cancellable:
+                    self._is_cancelled = True
+                    owner.cancel()
+                return
+
+    async def _reacquire(self):
+        while True:
+            try:
+                return await self.reacquire()
+            except LockError:
+                raise
+            except RedisError:
+                await asyncio.sleep(self.retry_delay)
+
+
 class RedisLockClient:
     @classmethod
     def get(cls, name: str):
         return Lock(redis=redis_client, name=name, blocking_timeout=10, timeout=9)
+
+    @classmethod
+    def get_renewable(cls, name: str, timeout: float = 30, blocking_timeout: float | None = 10):
+        return RenewableLock(redis=redis_client, name=name, blocking_timeout=blocking_timeout, timeout=timeout)
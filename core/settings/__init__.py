@@ -1,4 +1,5 @@
 from .base import *
+from .compression import *
 from .db import *
-from .projects import *
+from .imports import *
 from .redis import *
@@ -0,0 +1,29 @@
+import os
+from enum import Enum
+from enum import unique
+
+from core.utils import ImmutableModel
+
+
+@unique
+class CompressionProfile(str, Enum):
+    fast = "fast"  # large or streamed bodies, where CPU time of the worker matters more than the ratio
+    default = "default"
+
+
+class CompressionConfig(ImmutableModel):
+    minimum_size: int = os.getenv("COMPRESSION_MINIMUM_SIZE", 1024)  # smaller bodies are sent as is
+    # bytes of compressed bodies of responses with an ETag which are cached
+    cache_size: int = os.getenv("COMPRESSION_CACHE_SIZE", 16 * 1024 * 1024)
+    # media types which are compressed, others are sent as is
+    profiles: dict[str, CompressionProfile] = {
+        "application/json": CompressionProfile.default,
+        "text/html": CompressionProfile.default,
+        "text/plain": CompressionProfile.default,
+        "text/csv": CompressionProfile.fast,
+        "application/x-ndjson": CompressionProfile.fast,
+    }
+
+    @classmethod
+    def get_default(cls):
+        return CompressionConfig()
@@ -10,6 +10,10 @@ class DBConfig(ImmutableModel):
     database: str | None = os.getenv("DB_NAME", "database")
     port: int = os.getenv("DB_PORT", 5434)
     pool_size: int = 20
+    statement_cache_size: int = os.getenv("DB_STATEMENT_CACHE_SIZE", 1024)  # compiled statements of the process
+    cursor_batch_size: int = os.getenv("DB_CURSOR_BATCH_SIZE", 5000)  # rows fetched at a time by streaming reads
+    count_cap: int = os.getenv("DB_COUNT_CAP", 10000)  # rows counted at most by capped counts
+    prepared_statement_cache_size: int = os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", 1024)  # per connection
 
     @classmethod
     def get_default(cls):
@@ -0,0 +1,34 @@
+import os
+import tempfile
+from enum import Enum
+from enum import unique
+
+from core.utils import ImmutableModel
+
+
+@unique
+class ImportExecutor(str, Enum):
+    inline = "inline"  # parse on the event loop
+    process = "process"  # parse in a process pool, the event loop only moves bytes
+
+
+@unique
+class ImportLockScope(str, Enum):
+    project = "project"  # one import per project at a time
+    team = "team"  # imports of disjoint teams run in parallel
+
+
+class ImportConfig(ImmutableModel):
+    block_size: int = os.getenv("IMPORT_BLOCK_SIZE", 4 * 1024 * 1024)
+    batch_rows: int = os.getenv("IMPORT_BATCH_ROWS", 256 * 1024)  # rows validated at a time in columnar files
+    max_errors: int = os.getenv("IMPORT_MAX_ERRORS", 100)
+    executor: ImportExecutor = os.getenv("IMPORT_EXECUTOR", ImportExecutor.inline)  # the process pool is opt-in
+    workers: int = os.getenv("IMPORT_WORKERS", 2)
+    lock_scope: ImportLockScope = os.getenv("IMPORT_LOCK_SCOPE", ImportLockScope.team)
+    lock_timeout: float = os.getenv("IMPORT_LOCK_TIMEOUT", 30)  # the lock is renewed while the import runs
+    lock_blocking_timeout: float = os.getenv("IMPORT_LOCK_BLOCKING_TIMEOUT", 10)
+    spool_dir: str = os.getenv("IMPORT_SPOOL_DIR", tempfile.gettempdir())  # uploads waiting for background jobs
+
+    @classmethod
+    def get_default(cls):
+        return ImportConfig()
@@ -1 +0,0 @@
-PROJECTS = (1,)
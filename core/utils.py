@@ -1,4 +1,6 @@
 import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from decimal import Decimal
@@ -48,6 +50,24 @@ def set_max_workers_for_loop(loop, max_workers=6):
     loop.set_default_executor(ThreadPoolExecutor(max_workers=max_workers))
 
 
+_process_pools: dict[int, ProcessPoolExecutor] = {}
+
+
+def get_process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Pool for CPU-bound work, created lazily so every uvicorn worker starts its own processes."""
+    if (pool := _process_pools.get(max_workers)) is None:
+        pool = _process_pools[max_workers] = ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+    return pool
+
+
+def shutdown_process_pools():
+    while _process_pools:
+        _, pool = _process_pools.popitem()
+        pool.shutdown(cancel_futures=True)
+
+
 def get_event_loop_policy():
     try:
         import uvloop
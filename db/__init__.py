@@ -20,6 +20,16 @@ engine = create_engine(config.url)
 metadata = sqlalchemy.MetaData()
 
 
+class CachedDatabase(Database):
+    """Database which caches compiled statements, see `db.backends.StatementCache`."""
+
+    SUPPORTED_BACKENDS = {
+        **Database.SUPPORTED_BACKENDS,
+        "postgresql": "db.backends:CachedPostgresBackend",
+        "postgres": "db.backends:CachedPostgresBackend",
+    }
+
+
 class DatabaseTypeEnum(enum.Enum):
     DEFAULT = "default"
     NO_ROLLBACK = "no_rollback"  # hacks for websocket tests
@@ -54,10 +64,11 @@ class _DbRouter:
         if disable_jit:
             server_settings["jit"] = "off"
 
-        return Database(
+        return CachedDatabase(
             config.url,
             min_size=5,
             max_size=config.pool_size,
+            statement_cache_size=config.prepared_statement_cache_size,
             force_rollback=force_rollback,
             server_settings=server_settings,
         )
@@ -0,0 +1,135 @@
+import logging
+import typing
+from collections import OrderedDict
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+import asyncpg
+from databases.backends.postgres import PostgresBackend
+from databases.backends.postgres import PostgresConnection
+from databases.backends.postgres import Record
+from databases.core import Connection
+from sqlalchemy.engine.interfaces import Dialect
+from sqlalchemy.sql import ClauseElement
+from sqlalchemy.sql.ddl import DDLElement
+
+from core.settings import DBConfig
+
+logger = logging.getLogger(__name__)
+
+
+class StatementCache:
+    """LRU cache of SQL compiled for the `databases` Postgres backend, keyed by the shape of statements."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.is_enabled = True
+        self.hits = 0
+        self.misses = 0
+        self._statements: OrderedDict[tuple, tuple] = OrderedDict()
+
+    def get_stats(self) -> dict[str, int | bool]:
+        return {"enabled": self.is_enabled, "hits": self.hits, "misses": self.misses, "size": len(self._statements)}
+
+    def clear(self):
+        self.hits = self.misses = 0
+        self._statements.clear()
+
+    def compile(self, query: ClauseElement, dialect: Dialect) -> tuple[str, list, tuple] | None:
+        """SQL, arguments and result columns of the query, None if the query can't be cached."""
+        if not self.is_enabled:
+            return None
+        try:
+            return self._compile(query, dialect)
+        except AttributeError:
+            logger.exception("Statement cache is disabled, SQLAlchemy is incompatible")
+            self.is_enabled = False
+            self._statements.clear()
+            return None
+
+    def _compile(self, query: ClauseElement, dialect: Dialect) -> tuple[str, list, tuple] | None:
+        if isinstance(query, DDLElement) or (cache_key := query._generate_cache_key()) is None:
+            return None
+        # lists of IN are rendered as one parameter per item, so their lengths are a part of the shape
+        key = (cache_key.key, tuple(len(bind.effective_value) for bind in cache_key.bindparams if bind.expanding))
+
+        if (statement := self._statements.get(key)) is not None:
+            self.hits += 1
+            self._statements.move_to_end(key)
+        else:
+            self.misses += 1
+            # shapes which can't be cached are remembered too, not to be compiled twice every time
+            statement = self._statements[key] = self._prepare(query, cache_key, dialect) or ()
+            if len(self._statements) > self.maxsize:
+                self._statements.popitem(last=False)
+        if not statement:
+            return None
+
+        compiled, sql, arguments = statement
+        params = compiled.construct_params(extracted_parameters=cache_key.bindparams)
+        args = []
+        for name, index, processor in arguments:
+            value = params[name] if index is None else params[name][index]
+            args.append(processor(value) if processor is not None else value)
+        return sql, args, compiled._result_columns
+
+    @staticmethod
+    def _prepare(query: ClauseElement, cache_key, dialect: Dialect) -> tuple | None:
+        """Compile the query, its arguments are (parameter, index in an IN list, bind processor) in order of $n."""
+        compiled = query.compile(dialect=dialect, cache_key=cache_key)
+        if compiled.literal_execute_params:
+            return None  # values are rendered into the SQL
+        params = compiled.construct_params()
+        if compiled.post_compile_params:
+            expanded = compiled._process_parameters_for_postcompile(dict(params))  # it pops expanded lists
+            string, names = expanded.statement, sorted(expanded.additional_parameters)
+            # processors of the expansion are only those of the expanded parameters
+            processors = {**compiled._bind_processors, **expanded.processors}
+            items = {
+                name: (parent, index)
+                for parent, expanded_names in expanded.parameter_expansion.items()
+                for index, name in enumerate(expanded_names)
+            }
+            if any(
+                len(expanded_names) != len(params[parent])
+                for parent, expanded_names in expanded.parameter_expansion.items()
+            ):
+                return None  # e.g. IN of tuples, where an item is expanded into several parameters
+        else:
+            string, names, processors, items = compiled.string, sorted(params), compiled._bind_processors, {}
+        sql = string % {name: f"${i}" for i, name in enumerate(names, start=1)}
+        arguments = tuple((*items.get(name, (name, None)), processors.get(name)) for name in names)
+        return compiled, sql, arguments
+
+
+statement_cache = StatementCache(maxsize=DBConfig.get_default().statement_cache_size)
+
+
+class CachedPostgresConnection(PostgresConnection):
+    def _compile(self, query: ClauseElement) -> typing.Tuple[str, list, tuple]:
+        return statement_cache.compile(query, self._dialect) or super()._compile(query)
+
+
+class CachedPostgresBackend(PostgresBackend):
+    def connection(self) -> CachedPostgresConnection:
+        return CachedPostgresConnection(self, self._dialect)
+
+
+class RawConnection:
+    """The only user of private APIs of `databases`, for cursors, COPY and EXPLAIN on its asyncpg connection."""
+
+    def __init__(self, connection: Connection):
+        self._connection = connection
+        self._backend: PostgresConnection = connection._connection
+
+    def compile(self, query: ClauseElement) -> tuple[str, list, tuple]:
+        return self._backend._compile(query)
+
+    def get_records(self, rows: list, result_columns: tuple) -> list[Record]:
+        column_maps = self._backend._create_column_maps(result_columns)
+        return [Record(row, result_columns, self._backend._dialect, column_maps) for row in rows]
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[asyncpg.Connection]:
+        async with self._connection._query_lock:
+            yield self._connection.raw_connection
@@ -1,8 +1,12 @@
 from sqlalchemy import Column
+from sqlalchemy import DateTime
 from sqlalchemy import Identity
+from sqlalchemy import Index
 from sqlalchemy import Integer
 from sqlalchemy import String
 from sqlalchemy import Table
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import JSONB
 
 from db import metadata
 from db.utils import project_id_column
@@ -18,5 +22,24 @@ imports = Table(
     Column("id", Integer, Identity(always=True), primary_key=True),
     project_id_column(),
     Column("filename", String(length=255), nullable=False),
+    Column("mode", String(length=16), nullable=False, server_default="create"),
+    Column("status", String(length=16), nullable=False, server_default="finished"),
+    Column("inserted", Integer(), nullable=True),
+    Column("updated", Integer(), nullable=True),
+    Column("unchanged", Integer(), nullable=True),
+    Column("error", JSONB(), nullable=True),
+    Column("started", DateTime(timezone=False), nullable=True),
+    Column("finished", DateTime(timezone=False), nullable=True),
+    Column("content_hash", String(length=64), nullable=True),  # SHA-256 of the file, hex
+    Column("idempotency_key", String(length=255), nullable=True),  # `Idempotency-Key` header of the request
     TimeStampedFields().created,
+    Index("imports_project_id_content_hash_idx", "project_id", "content_hash"),
+    # a key is taken by one import at a time, failed imports wrote nothing and leave it to a retry
+    Index(
+        "imports_project_id_idempotency_key_idx",
+        "project_id",
+        "idempotency_key",
+        unique=True,
+        postgresql_where=text("idempotency_key IS NOT NULL AND status != 'failed'"),
+    ),
 )
@@ -1,3 +1,4 @@
+from sqlalchemy import BigInteger
 from sqlalchemy import Column
 from sqlalchemy import SMALLINT
 from sqlalchemy import String
@@ -15,5 +16,6 @@ project = Table(
     metadata,
     Column("id", SMALLINT, primary_key=True),
     Column("name", String(length=25), unique=True),
+    Column("data_version", BigInteger(), nullable=False, server_default="0"),  # bumped by every import with changes
     *TimeStampedFields().all,
 )
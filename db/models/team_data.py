@@ -1,7 +1,9 @@
+from sqlalchemy import BigInteger
 from sqlalchemy import Column
 from sqlalchemy import Date
 from sqlalchemy import ForeignKey
 from sqlalchemy import Identity
+from sqlalchemy import Index
 from sqlalchemy import Integer
 from sqlalchemy import String
 from sqlalchemy import Table
@@ -11,7 +13,7 @@ from db import metadata
 from db.utils import project_id_column
 from db.utils import TimeStampedFields
 
-__all__ = ["team", "team_stats", "team_data"]
+__all__ = ["team", "team_stats", "team_data", "team_data_weekly", "team_data_monthly"]
 
 team = Table(
     "team",
@@ -30,6 +32,22 @@ team_stats = Table(
     Column("id", Integer, Identity(always=True), primary_key=True),
     Column("team_id", Integer, ForeignKey("team.id", name="team_id_fk", ondelete="RESTRICT"), unique=True),
     project_id_column(),
+    # running aggregates over all team_data of the team, maintained by imports
+    Column("rows_count", Integer(), nullable=False, server_default="0"),
+    Column("review_time_sum", BigInteger(), nullable=True),
+    Column("review_time_min", Integer(), nullable=True),
+    Column("review_time_max", Integer(), nullable=True),
+    Column("merge_time_sum", BigInteger(), nullable=True),
+    Column("merge_time_min", Integer(), nullable=True),
+    Column("merge_time_max", Integer(), nullable=True),
+    Column("first_date", Date(), nullable=True),
+    Column("last_date", Date(), nullable=True),
+    Column(
+        "last_import_id",
+        Integer,
+        ForeignKey("imports.id", name="last_import_id_fk", ondelete="SET NULL"),
+        nullable=True,
+    ),
     *TimeStampedFields().all,
 )
 
@@ -45,4 +63,44 @@ team_data = Table(
     project_id_column(),
     *TimeStampedFields().all,
     UniqueConstraint("team_id", "date", name="team_data_unique"),
+    Index("team_data_project_id_date_idx", "project_id", "date"),  # date range reads of a whole project
 )
+
+
+def rollup_table(name: str, bucket: str, rolling_windows: tuple[int, ...] = ()) -> Table:
+    """Aggregates of `team_data` per team and bucket, `date_trunc` unit of which is `bucket`."""
+    tail_columns = [
+        Column(f"{column}_{days}d", type_, nullable=column != "rows_count", server_default=default)
+        for days in rolling_windows
+        for column, type_, default in (
+            ("rows_count", Integer(), "0"),
+            ("review_time_sum", BigInteger(), None),
+            ("merge_time_sum", BigInteger(), None),
+        )
+    ]
+    return Table(
+        name,
+        metadata,
+        Column("id", Integer, Identity(always=True), primary_key=True),
+        Column("team_id", Integer, ForeignKey("team.id", name="team_id_fk", ondelete="RESTRICT"), nullable=False),
+        project_id_column(),
+        Column("bucket", Date(), nullable=False),  # first day of the bucket
+        Column("rows_count", Integer(), nullable=False),
+        Column("review_time_sum", BigInteger(), nullable=False),
+        Column("review_time_min", Integer(), nullable=False),
+        Column("review_time_max", Integer(), nullable=False),
+        Column("merge_time_sum", BigInteger(), nullable=False),
+        Column("merge_time_min", Integer(), nullable=False),
+        Column("merge_time_max", Integer(), nullable=False),
+        *tail_columns,
+        *TimeStampedFields().all,
+        UniqueConstraint("team_id", "bucket", name=f"{name}_unique"),
+        Index(f"{name}_project_id_bucket_idx", "project_id", "bucket"),
+        info={"bucket": bucket, "rolling_windows": rolling_windows},
+    )
+
+
+team_data_weekly = rollup_table("team_data_weekly", "week")
+
+# a month contains the longest rolling window, so rolling averages of months are computed from its tail
+team_data_monthly = rollup_table("team_data_monthly", "month", rolling_windows=(7, 28))
@@ -1,36 +1,81 @@
 import asyncio
+import base64
+import dataclasses
 import enum
 import itertools
+from collections.abc import AsyncIterator
+from collections.abc import Callable
+from collections.abc import Iterable
+from collections.abc import Mapping
+from collections.abc import Sequence
 from datetime import timedelta
+from enum import unique
+from functools import cache
+from functools import lru_cache
 from functools import wraps
 from typing import Any
 
+import numpy
+import orjson
 from asyncpg.exceptions import UniqueViolationError
 from databases.interfaces import Record
 from pydantic import NonNegativeInt
 from sqlalchemy import all_
+from sqlalchemy import and_
 from sqlalchemy import any_
 from sqlalchemy import asc
+from sqlalchemy import cast
 from sqlalchemy import Column
 from sqlalchemy import desc
 from sqlalchemy import exists
 from sqlalchemy import func
+from sqlalchemy import literal
 from sqlalchemy import or_
 from sqlalchemy import PrimaryKeyConstraint
 from sqlalchemy import select
 from sqlalchemy import Table
+from sqlalchemy import tuple_
 from sqlalchemy import UniqueConstraint
 from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.sql.expression import bindparam
 from sqlalchemy.sql.expression import delete
 from sqlalchemy.sql.expression import text
 from sqlalchemy.sql.functions import Function
+from sqlalchemy.sql.selectable import TableValuedAlias
 
 from core.contexts import PROJECT_ID
+from core.exceptions import BadRequestException
 from core.exceptions import ConflictException
+from core.settings import DBConfig
 from core.types import NonEmptyStr
 from db import Database
+from db.backends import RawConnection
+
+
+@unique
+class ResultMode(str, enum.Enum):
+    dict = "dict"  # a dict per row
+    record = "record"  # records of the database driver as they are
+    tuple = "tuple"  # a tuple per row
+    columns = "columns"  # a NumPy array per column, keyed by column names
+
+
+@unique
+class CountMode(str, enum.Enum):
+    none = "none"
+    exact = "exact"  # count(*) of all the rows
+    capped = "capped"  # count(*) of at most `count_cap` rows
+    estimate = "estimate"  # rows estimated by the planner, no rows are read
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Page:
+    items: list[dict]
+    next_cursor: str | None
+    count: int | None = None
+    count_is_exact: bool = True
 
 
 class BaseQuery:
@@ -143,24 +188,43 @@ class BaseQuery:
 
     def _set_project_id_to_kwargs(self, kwargs):
         if self.table_model.columns.get("project_id") is not None:
-            if project_id := PROJECT_ID.get():
+            if project_id := PROJECT_ID.get(None):
                 kwargs.setdefault("project_id", project_id)
 
-    def _get_columns(self, key_name: str) -> Any | list:
+    @staticmethod
+    def _get_columns(table_model: Table, key_name: str) -> Any | list:
         columns = key_name.split("__or__")
         if len(columns) == 1:
-            return self.table_model.columns.get(columns[0])
-        elif all(col in self.table_model.columns for col in columns):
-            return [self.table_model.columns[col] for col in columns]
+            return table_model.columns.get(columns[0])
+        elif all(col in table_model.columns for col in columns):
+            return [table_model.columns[col] for col in columns]
+
+    @classmethod
+    @cache
+    def _get_suffixes(cls) -> tuple[str, ...]:
+        """Suffixes of `_select_conditions` in the order they are tried: the longest first, patterns and default last."""
+        return tuple(
+            sorted(cls._select_conditions, key=lambda suffix: (is_pattern(suffix) or not suffix, -len(suffix)))
+        )
 
-    def filters(self, q, **kwargs) -> select:
-        for key, value in (kwargs.get("filters") or {}).items():
-            for suffix, condition in self._select_conditions.items():
+    @classmethod
+    @lru_cache(maxsize=1024)
+    def _get_filter_plan(cls, table_model: Table, keys: tuple[str, ...]) -> tuple[tuple[str, Callable, Any], ...]:
+        """Key, condition and column of every filter, compiled once per table and set of keys."""
+        plan = []
+        for key in keys:
+            for suffix in cls._get_suffixes():
                 if column_name := get_column_name(key, suffix):
-                    column = self._get_columns(column_name)
+                    column = cls._get_columns(table_model, column_name)
                     if column is not None:
-                        q = q.where(condition(column, value))
+                        plan.append((key, cls._select_conditions[suffix], column))
                         break
+        return tuple(plan)
+
+    def filters(self, q, **kwargs) -> select:
+        if filters := kwargs.get("filters"):
+            for key, condition, column in self._get_filter_plan(self.table_model, tuple(filters)):
+                q = q.where(condition(column, filters[key]))
         return q
 
     def filters_by_related_tables(self, q: select, filters: dict, tables_with_keys: dict[NonEmptyStr, Table]) -> select:
@@ -236,27 +300,58 @@ class BaseQuery:
 
     @staticmethod
     def convertor(fn):
+        """Convert records of the response according to the `result_mode` keyword, dicts by default."""
+
         @wraps(fn)
-        async def wrapper(*args, **kwargs) -> list[dict] | dict | None:
+        async def wrapper(*args, result_mode: ResultMode = ResultMode.dict, **kwargs):
             response = await fn(*args, **kwargs)
 
             if isinstance(response, list):
-                return [dict(db_entity) for db_entity in response]
+                return convert_records(response, result_mode)
 
             elif isinstance(response, Record):
-                return dict(response)
+                result = convert_records([response], result_mode)
+                return result if result_mode == ResultMode.columns else result[0]
 
         return wrapper
 
-    async def get_entity(self, **kwargs) -> dict:
+    async def get_entity(self, result_mode: ResultMode = ResultMode.dict, **kwargs) -> dict:
         q = self.prepare_query(**kwargs)
 
-        return await self.get_entity_by_query(q=q)
+        return await self.get_entity_by_query(q=q, result_mode=result_mode)
 
-    async def get_entities(self, limit: int = None, offset: int = None, **kwargs) -> list[dict]:
+    async def get_entities(
+        self, limit: int = None, offset: int = None, result_mode: ResultMode = ResultMode.dict, **kwargs
+    ) -> list[dict]:
         q = self.prepare_query(**kwargs)
 
-        return await self.get_entities_by_query(q=q, limit=limit, offset=offset)
+        return await self.get_entities_by_query(q=q, limit=limit, offset=offset, result_mode=result_mode)
+
+    def iterate_entities(
+        self, batch_size: int | None = None, result_mode: ResultMode = ResultMode.dict, **kwargs
+    ) -> AsyncIterator[list | dict]:
+        # the iterator is returned as is, so closing it closes the cursor
+        return self.iterate_by_query(self.prepare_query(**kwargs), batch_size, result_mode)
+
+    async def iterate_by_query(
+        self, q: select, batch_size: int | None = None, result_mode: ResultMode = ResultMode.dict
+    ) -> AsyncIterator[list | dict]:
+        """Stream rows in batches from a server-side cursor, only one batch is held in memory at a time."""
+        batch_size = batch_size or DBConfig.get_default().cursor_batch_size
+        async with self.conn.connection() as connection:
+            async with connection.transaction():
+                raw_connection = RawConnection(connection)
+                sql, args, result_columns = raw_connection.compile(q)
+                async with raw_connection.acquire() as asyncpg_connection:
+                    cursor = await asyncpg_connection.cursor(sql, *args)
+                while True:
+                    async with raw_connection.acquire():
+                        rows = await cursor.fetch(batch_size)
+                    if not rows:
+                        return
+                    yield convert_records(raw_connection.get_records(rows, result_columns), result_mode)
+                    if len(rows) < batch_size:
+                        return
 
     async def get_count(self, **kwargs) -> NonNegativeInt:
         q = select([self.table_model])
@@ -289,7 +384,7 @@ class BaseQuery:
     @convertor
     async def bulk_create(self, values: list[dict], is_returning=True) -> list[dict] | None:
         if self.table_model.columns.get("project_id") is not None:
-            if project_id := PROJECT_ID.get():
+            if project_id := PROJECT_ID.get(None):
                 for x in values:
                     x.setdefault("project_id", project_id)
 
@@ -323,18 +418,78 @@ class BaseQuery:
         if is_returning:
             return list(itertools.chain(*db_queries))
 
+    async def copy_records(self, records: Iterable[Sequence], columns: Sequence[str]) -> None:
+        """Load rows with binary COPY: no statement compilation, no bind parameters and no RETURNING."""
+        if self.table_model.columns.get("project_id") is not None and "project_id" not in columns:
+            if project_id := PROJECT_ID.get(None):
+                columns = [*columns, "project_id"]
+                records = ((*record, project_id) for record in records)
+
+        async with self.conn.connection() as connection:
+            async with RawConnection(connection).acquire() as asyncpg_connection:
+                try:
+                    await asyncpg_connection.copy_records_to_table(
+                        self.table_model.name, records=records, columns=columns, schema_name=self.table_model.schema
+                    )
+                except UniqueViolationError as e:
+                    raise ConflictException(e.detail)
+
+    async def copy_columns(self, columns: Mapping[str, Sequence]) -> None:
+        await self.copy_records(
+            zip(*(values.tolist() if hasattr(values, "tolist") else values for values in columns.values())),
+            columns=list(columns),
+        )
+
+    def _get_batch(self, values: list[dict]) -> TableValuedAlias:
+        columns = [self.table_model.columns[key] for key in values[0]]
+        arrays = (  # typed explicitly, as unnest() is polymorphic
+            cast(bindparam(f"batch_{c.name}", [x[c.name] for x in values], type_=ARRAY(c.type)), ARRAY(c.type))
+            for c in columns
+        )
+        return func.unnest(*arrays).table_valued(*(c.name for c in columns)).render_derived(name="batch")
+
     async def bulk_update(self, values: list[dict]) -> None:
         if self.table_model.columns.get("project_id") is not None:
-            if PROJECT_ID.get():
+            if PROJECT_ID.get(None):
                 for val in values:
                     val.pop("project_id", None)
+        if not values:
+            return
+        batch = self._get_batch(values)
         q = (
             update(self.table_model)
-            .where(self.table_model.c.id == bindparam("id"))
-            .values(**{key: bindparam(key) for key in values[0].keys() if key not in ("id", "project_id")})
+            .where(self.table_model.c.id == batch.c.id)
+            .values({key: batch.c[key] for key in values[0].keys() if key not in ("id", "project_id")})
         )
 
-        await self.conn.execute_many(str(q), values)
+        await self.conn.execute(q)
+
+    @convertor
+    async def bulk_upsert(self, values: list[dict], on_conflict="update", is_returning=False) -> list[dict] | None:
+        """Upsert rows on `_get_index_keys()` with a single INSERT ... SELECT FROM unnest(...) statement."""
+        if not values:
+            return [] if is_returning else None
+        if self.table_model.columns.get("project_id") is not None:
+            if project_id := PROJECT_ID.get(None):
+                for x in values:
+                    x.setdefault("project_id", project_id)
+
+        index_keys = self._get_index_keys()
+        batch = self._get_batch(values)
+        statement = insert(self.table_model).from_select(list(values[0]), select(batch))
+
+        if on_conflict == "update":
+            set_clause = {key: getattr(statement.excluded, key) for key in values[0].keys() if key not in index_keys}
+            if "modified" in self.table_model.columns:
+                set_clause["modified"] = func.now()
+            q = statement.on_conflict_do_update(index_elements=index_keys, set_=set_clause)
+        else:
+            q = statement.on_conflict_do_nothing()
+
+        try:
+            return await (self.conn.fetch_all(q.returning(self.table_model)) if is_returning else self.conn.execute(q))
+        except UniqueViolationError as e:
+            raise ConflictException(e.detail)
 
     async def update(self, is_returning=True, **kwargs) -> dict | None:
         q = update(self.table_model)
@@ -393,11 +548,108 @@ class BaseQuery:
     async def is_exists_entity_by_query(self, q: exists) -> bool:
         return await self.conn.execute(select([q]))
 
-    async def get_entities_with_count(self, q: select, limit: int, offset: int) -> (list, int):
-        return await asyncio.gather(
+    async def get_entities_with_count(
+        self,
+        q: select,
+        limit: int,
+        offset: int,
+        count_mode: CountMode = CountMode.exact,
+        count_cap: int | None = None,
+    ) -> (list, int):
+        entities, (count, _) = await asyncio.gather(
             self.get_entities_by_query(q=q, limit=limit, offset=offset),
-            self.get_count_by_query(q=q),
+            self.get_count_by_mode(q=q, count_mode=count_mode, count_cap=count_cap),
+        )
+        return entities, count
+
+    async def get_count_by_mode(
+        self, q: select, count_mode: CountMode, count_cap: int | None = None
+    ) -> tuple[int | None, bool]:
+        if count_mode == CountMode.none:
+            return None, True
+        if count_mode == CountMode.estimate:
+            return await self.get_estimated_count_by_query(q), False
+        if count_mode == CountMode.capped:
+            count_cap = count_cap or DBConfig.get_default().count_cap
+            count = await self.get_count_by_query(q.limit(count_cap + 1))
+            return min(count, count_cap), count <= count_cap
+        return await self.get_count_by_query(q), True
+
+    async def get_estimated_count_by_query(self, q: select) -> int:
+        """Number of rows the planner expects from table statistics, which are as fresh as the last ANALYZE."""
+        async with self.conn.connection() as connection:
+            raw_connection = RawConnection(connection)
+            sql, args, _ = raw_connection.compile(q)
+            async with raw_connection.acquire() as asyncpg_connection:
+                plan = await asyncpg_connection.fetchval(f"EXPLAIN (FORMAT JSON) {sql}", *args)
+        return orjson.loads(plan)[0]["Plan"]["Plan Rows"]
+
+    def _get_keyset(self, order_by: list[str] | None) -> list[tuple[Column, bool]]:
+        """Columns of the order with their directions (True for descending), completed by the primary key."""
+        keyset = []
+        for key in order_by or []:
+            if key.endswith(self.ORDER_BY_LABEL):
+                raise ValueError(f"Can't paginate by the label {key}")
+            keyset.append((self.table_model.columns[key.removeprefix(self.ORDER_BY)], key.startswith(self.ORDER_BY)))
+        names = {column.name for column, _ in keyset}
+        constraints = (
+            c for c in self.table_model.constraints if isinstance(c, (PrimaryKeyConstraint, UniqueConstraint))
+        )
+        if not any({column.name for column in constraint.columns} <= names for constraint in constraints):
+            keyset += [(column, False) for column in self.table_model.primary_key.columns if column.name not in names]
+        return keyset
+
+    @staticmethod
+    def _seek(keyset: list[tuple[Column, bool]], values: list) -> Any:
+        if len({descending for _, descending in keyset}) == 1:
+            columns = tuple_(*(column for column, _ in keyset))
+            values = tuple_(*(literal(value, column.type) for (column, _), value in zip(keyset, values)))
+            return columns < values if keyset[0][1] else columns > values
+        conditions = []
+        for i, (column, descending) in enumerate(keyset):
+            value = literal(values[i], column.type)
+            conditions.append(
+                and_(
+                    *(c == literal(v, c.type) for (c, _), v in zip(keyset[:i], values)),
+                    column < value if descending else column > value,
+                )
+            )
+        return or_(*conditions)
+
+    @staticmethod
+    def _encode_cursor(keyset: list[tuple[Column, bool]], entity: dict) -> str:
+        return base64.urlsafe_b64encode(orjson.dumps([entity[column.name] for column, _ in keyset])).decode()
+
+    @staticmethod
+    def _decode_cursor(keyset: list[tuple[Column, bool]], cursor: str) -> list:
+        try:
+            values = orjson.loads(base64.urlsafe_b64decode(cursor))
+            if not isinstance(values, list) or len(values) != len(keyset):
+                raise ValueError(cursor)
+            return [_decode_cursor_value(column.type.python_type, value) for (column, _), value in zip(keyset, values)]
+        except (ValueError, TypeError, ArithmeticError, NotImplementedError):
+            raise BadRequestException(detail="Invalid cursor")
+
+    async def get_entities_page(
+        self,
+        limit: int,
+        cursor: str | None = None,
+        count_mode: CountMode = CountMode.none,
+        count_cap: int | None = None,
+        **kwargs,
+    ) -> Page:
+        keyset = self._get_keyset(kwargs.get("order_by"))
+        if return_fields := kwargs.get("return_fields"):
+            kwargs["return_fields"] = [*return_fields, *(c.name for c, _ in keyset if c.name not in return_fields)]
+        q = self.prepare_query(**kwargs).order_by(None)
+        page_q = q if cursor is None else q.where(self._seek(keyset, self._decode_cursor(keyset, cursor)))
+        page_q = page_q.order_by(*(desc(column) if descending else asc(column) for column, descending in keyset))
+
+        items, (count, count_is_exact) = await asyncio.gather(
+            self.get_entities_by_query(page_q, limit=limit + 1), self.get_count_by_mode(q, count_mode, count_cap)
         )
+        next_cursor = self._encode_cursor(keyset, items[limit - 1]) if len(items) > limit else None
+        return Page(items=items[:limit], next_cursor=next_cursor, count=count, count_is_exact=count_is_exact)
 
     async def get_value(self, column: str, **kwargs) -> Any:
         q = select(self.table_model.columns[column])
@@ -429,11 +681,56 @@ class BaseQuery:
         return q
 
 
+def _decode_cursor_value(python_type: type, value: Any) -> Any:
+    if value is None or isinstance(value, python_type):
+        return value
+    if isinstance(value, str) and hasattr(python_type, "fromisoformat"):  # dates are serialized to ISO strings
+        return python_type.fromisoformat(value)
+    return python_type(value)
+
+
+def convert_records(records: list[Record], mode: ResultMode) -> list | dict[str, numpy.ndarray]:
+    if mode == ResultMode.record:
+        return records
+    if not records:
+        return {} if mode == ResultMode.columns else []
+
+    first = records[0]
+    names = list(first._row.keys())
+    processors = [None] * len(names)
+    if first._column_map:  # otherwise a raw query, values are returned as they are
+        processors = [
+            datatype._cached_result_processor(first._dialect, None) for _, datatype in first._column_map_int.values()
+        ]
+
+    if mode == ResultMode.columns:
+        columns = {}
+        for index, (name, processor) in enumerate(zip(names, processors)):
+            values = [record._row[index] for record in records]
+            columns[name] = numpy.array(values if processor is None else [processor(value) for value in values])
+        return columns
+
+    if any(processors):
+        rows = (
+            tuple(value if processor is None else processor(value) for processor, value in zip(processors, record._row))
+            for record in records
+        )
+    else:
+        rows = (tuple(record._row) for record in records)
+    if mode == ResultMode.tuple:
+        return list(rows)
+    return [dict(zip(names, row)) for row in rows]
+
+
+def is_pattern(suffix: str) -> bool:
+    return suffix.startswith("*") and suffix.endswith("*")
+
+
 def get_column_name(key, suffix) -> str:
     if key.endswith(suffix):
         return key.removesuffix(suffix)
 
-    if suffix.startswith("*") and suffix.endswith("*") and suffix.removesuffix("*").removeprefix("*") in key:
+    if is_pattern(suffix) and suffix.removesuffix("*").removeprefix("*") in key:
         return key
 
     return ""
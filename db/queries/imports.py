@@ -0,0 +1,60 @@
+from sqlalchemy import exists
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from db.queries.base import BaseQuery
+
+
+class ImportQuery(BaseQuery):
+    async def create_unless_key_taken(self, **kwargs) -> dict | None:
+        """Create the import unless another import holds its idempotency key, which it then returns None for."""
+        self._set_project_id_to_kwargs(kwargs)
+        table = self.table_model
+        (index,) = (index for index in table.indexes if index.name == "imports_project_id_idempotency_key_idx")
+        q = (
+            insert(table)
+            .values(**kwargs)
+            .on_conflict_do_nothing(
+                index_elements=[table.c.project_id, table.c.idempotency_key],
+                index_where=index.dialect_options["postgresql"]["where"],
+            )
+            .returning(table)
+        )
+        return await self.get_entity_by_query(q)
+
+    async def get_by_idempotency_key(self, project_id: int, idempotency_key: str, exclude_status: str) -> dict | None:
+        table = self.table_model
+        q = (
+            select(table)
+            .where(
+                table.c.project_id == project_id,
+                table.c.idempotency_key == idempotency_key,
+                table.c.status != exclude_status,
+            )
+            .order_by(table.c.id.desc())
+            .limit(1)
+        )
+        return await self.get_entity_by_query(q)
+
+    async def get_duplicate(self, project_id: int, content_hash: str, mode: str, status: str) -> dict | None:
+        """The latest import of the same file in the same mode, if no import with `status` has changed data since."""
+        table, later = self.table_model, self.table_model.alias("later")
+        changed_since = exists().where(
+            later.c.project_id == table.c.project_id,
+            later.c.id > table.c.id,
+            later.c.status == status,
+            (later.c.inserted > 0) | (later.c.updated > 0),
+        )
+        q = (
+            select(table)
+            .where(
+                table.c.project_id == project_id,
+                table.c.content_hash == content_hash,
+                table.c.mode == mode,
+                table.c.status == status,
+                ~changed_since,
+            )
+            .order_by(table.c.id.desc())
+            .limit(1)
+        )
+        return await self.get_entity_by_query(q)
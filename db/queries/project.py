@@ -0,0 +1,12 @@
+from db.queries.base import BaseQuery
+
+
+class ProjectQuery(BaseQuery):
+    async def bump_data_version(self, project_id: int) -> int:
+        """Increment the data version, the row stays locked by the transaction until it ends."""
+        q = f"""
+            UPDATE {self.table_model.name} SET data_version = data_version + 1, modified = now()
+            WHERE id = :project_id
+            RETURNING data_version
+        """
+        return await self.conn.fetch_val(q, values={"project_id": project_id})
@@ -0,0 +1,32 @@
+from core.contexts import PROJECT_ID
+from db.queries.base import BaseQuery
+
+
+class TeamQuery(BaseQuery):
+    async def get_or_create_ids(self, names: set[str]) -> dict[str, int]:
+        project_id = PROJECT_ID.get()
+        # raw query: RETURNING inside a CTE breaks the result columns mapping of compiled SQLAlchemy statements
+        q = f"""
+            WITH inserted AS (
+                INSERT INTO {self.table_model.name} (project_id, name)
+                SELECT :project_id, unnest(CAST(:names AS VARCHAR[]))
+                ON CONFLICT ON CONSTRAINT team_unique DO NOTHING
+                RETURNING name, id
+            )
+            SELECT name, id FROM inserted
+            UNION ALL
+            SELECT name, id FROM {self.table_model.name}
+            WHERE project_id = :project_id AND name = ANY(CAST(:names AS VARCHAR[]))
+        """
+        rows = await self.conn.fetch_all(q, values={"project_id": project_id, "names": list(names)})
+        ids = {row["name"]: row["id"] for row in rows}
+
+        # a team committed by a concurrent transaction after the statement has started is visible to neither part
+        if missing := names - ids.keys():
+            ids |= {
+                row["name"]: row["id"]
+                for row in await self.get_entities(
+                    filters={"name__in": missing, "project_id": project_id}, return_fields={"name", "id"}
+                )
+            }
+        return ids
@@ -0,0 +1,193 @@
+import calendar
+import datetime
+from collections.abc import Iterable
+from collections.abc import Mapping
+from collections.abc import Sequence
+
+import numpy
+from sqlalchemy import cast
+from sqlalchemy import Date
+from sqlalchemy import Float
+from sqlalchemy import func
+from sqlalchemy import literal
+from sqlalchemy import literal_column
+from sqlalchemy import select
+from sqlalchemy import Table
+from sqlalchemy.sql import Subquery
+
+from core.contexts import PROJECT_ID
+from db import Database
+from db.models import team
+from db.models import team_data_monthly
+from db.models import team_data_weekly
+from db.models import team_stats
+from db.queries.base import BaseQuery
+from db.queries.team_rollup import TeamRollupQuery
+from db.queries.team_stats import TeamStatsQuery
+
+# rows of a batch sent column-wise, every column is a single array parameter
+BATCH_SOURCE = """
+    unnest(
+        CAST(:team_id AS INTEGER[]),
+        CAST(:date AS DATE[]),
+        CAST(:review_time AS INTEGER[]),
+        CAST(:merge_time AS INTEGER[])
+    ) AS batch (team_id, date, review_time, merge_time)
+"""
+
+
+class TeamDataQuery(BaseQuery):
+    TEAM_LOCK_NAMESPACE = 1  # first key of advisory locks on teams
+    IMPORT_KEYS = "import_keys"  # temporary table of keys upserted by the import in the transaction
+
+    METRICS = ("review_time", "merge_time")
+    ROLLING_WINDOWS = (7, 28)  # days
+    BUCKET_DAYS = {"day": 1, "week": 7}  # buckets of a fixed length, months fit the longest rolling window
+    EPOCH = datetime.date(1970, 1, 1)
+    EXPORT_COLUMNS = ("team", "date", "review_time", "merge_time")
+
+    def __init__(self, *, conn: Database, table_model: Table) -> None:
+        super().__init__(conn=conn, table_model=table_model)
+        self.stats = TeamStatsQuery(conn=conn, table_model=team_stats)
+        self.rollups = {
+            rollup.bucket: rollup
+            for rollup in (
+                TeamRollupQuery(conn=conn, table_model=team_data_weekly),
+                TeamRollupQuery(conn=conn, table_model=team_data_monthly),
+            )
+        }
+
+    async def lock_teams(self, team_ids: Iterable[int]) -> None:
+        """Take transaction-level advisory locks on teams in ascending order, they are released on commit or rollback."""
+        q = """
+            SELECT pg_advisory_xact_lock(CAST(:namespace AS INTEGER), team_id)
+            FROM (SELECT unnest(CAST(:team_ids AS INTEGER[])) AS team_id ORDER BY team_id) AS teams
+        """
+        await self.conn.execute(q, values={"namespace": self.TEAM_LOCK_NAMESPACE, "team_ids": sorted(team_ids)})
+
+    async def create_import_keys(self) -> None:
+        """Track keys written by upserts until the transaction ends, another import of it starts afresh."""
+        await self.conn.execute(f"DROP TABLE IF EXISTS {self.IMPORT_KEYS}")
+        await self.conn.execute(
+            f"""
+            CREATE TEMPORARY TABLE {self.IMPORT_KEYS} (team_id INTEGER, date DATE, PRIMARY KEY (team_id, date))
+            ON COMMIT DROP
+            """
+        )
+
+    @staticmethod
+    def _get_batch_values(columns: Mapping[str, Sequence]) -> dict[str, list]:
+        return {key: value.tolist() if hasattr(value, "tolist") else list(value) for key, value in columns.items()}
+
+    async def add_stats(self, columns: Mapping[str, numpy.ndarray], import_id: int) -> None:
+        values = {**self.stats.get_deltas(columns), "project_id": PROJECT_ID.get(), "import_id": import_id}
+        await self.conn.execute(self.stats.get_add_sql(), values=values)
+
+    async def recompute_stats(self, team_ids: Iterable[int], import_id: int) -> None:
+        """Replace stats of teams with aggregates over all of their rows, for updates which can't be applied as a delta."""
+        q = self.stats.get_upsert_sql(
+            self.table_model.name, where="team_id = ANY(CAST(:team_ids AS INTEGER[]))", replace=True
+        )
+        values = {"team_ids": sorted(team_ids), "project_id": PROJECT_ID.get(), "import_id": import_id}
+        await self.conn.execute(q, values=values)
+
+    async def upsert_columns(self, columns: Mapping[str, Sequence], import_id: int) -> tuple[int, int, set[int], int]:
+        """Upsert rows given column-wise on `team_data_unique`, rows with unchanged metrics are not written."""
+        q = f"""
+            WITH upserted AS (
+                INSERT INTO {self.table_model.name} (team_id, date, review_time, merge_time, project_id)
+                SELECT team_id, date, review_time, merge_time, :project_id
+                FROM {BATCH_SOURCE}
+                ON CONFLICT ON CONSTRAINT team_data_unique DO UPDATE
+                SET review_time = EXCLUDED.review_time, merge_time = EXCLUDED.merge_time, modified = now()
+                WHERE ({self.table_model.name}.review_time, {self.table_model.name}.merge_time)
+                    IS DISTINCT FROM (EXCLUDED.review_time, EXCLUDED.merge_time)
+                RETURNING team_id, date, review_time, merge_time, xmax = 0 AS is_inserted  -- xmax of a new row is 0
+            ), stats AS (
+                {self.stats.get_upsert_sql("upserted", where="is_inserted")}
+            ), tracked AS (
+                INSERT INTO {self.IMPORT_KEYS} (team_id, date)
+                SELECT team_id, date FROM {BATCH_SOURCE}
+                ON CONFLICT DO NOTHING
+                RETURNING 1
+            )
+            SELECT
+                count(*) FILTER (WHERE is_inserted) AS inserted,
+                count(*) FILTER (WHERE NOT is_inserted) AS updated,
+                array_agg(DISTINCT team_id) FILTER (WHERE NOT is_inserted) AS updated_team_ids,
+                (SELECT count(*) FROM tracked) AS tracked
+            FROM upserted
+        """
+        values = {**self._get_batch_values(columns), "project_id": PROJECT_ID.get(), "import_id": import_id}
+        row = await self.conn.fetch_one(q, values=values)
+        repeated = len(columns["team_id"]) - row["tracked"]
+        return row["inserted"], row["updated"], set(row["updated_team_ids"] or ()), repeated
+
+    @staticmethod
+    def get_bucket_bounds(date_from: datetime.date, date_to: datetime.date, bucket: str) -> tuple[datetime.date, ...]:
+        if bucket == "week":
+            return date_from - datetime.timedelta(days=date_from.weekday()), date_to + datetime.timedelta(
+                days=6 - date_to.weekday()
+            )
+        if bucket == "month":
+            return date_from.replace(day=1), date_to.replace(day=calendar.monthrange(date_to.year, date_to.month)[1])
+        return date_from, date_to
+
+    async def refresh_rollups(self, buckets: Mapping[str, Iterable[tuple[int, datetime.date]]]) -> None:
+        for bucket, keys in buckets.items():
+            if keys := sorted(keys):
+                team_ids, starts = zip(*keys)
+                await self.rollups[bucket].refresh(team_ids, starts)
+
+    def _get_buckets(self, bucket: str, date_from: datetime.date, date_to: datetime.date, **kwargs) -> Subquery:
+        if rollup := self.rollups.get(bucket):
+            t = rollup.table_model
+            q = select([t.c.team_id, t.c.bucket, *rollup.get_aggregate_columns()])
+            q = q.where(t.c.bucket >= date_from, t.c.bucket <= date_to)
+            return rollup.filters(q, **kwargs).subquery("buckets")
+
+        t = self.table_model
+        columns = [t.c.team_id, t.c.date.label("bucket"), literal_column("1").label("rows_count")]
+        for metric in self.METRICS:
+            columns += [t.c[metric].label(f"{metric}_{aggregate}") for aggregate in ("sum", "min", "max")]
+        q = select(columns).where(t.c.date >= date_from, t.c.date <= date_to)
+        return self.filters(q, **kwargs).subquery("buckets")
+
+    async def get_aggregates(
+        self, date_from: datetime.date, date_to: datetime.date, bucket: str, **kwargs
+    ) -> list[dict]:
+        """Aggregate metrics per team and bucket, weeks and months are read from rollups maintained by imports."""
+        lower, upper = self.get_bucket_bounds(date_from, date_to, bucket)
+        bucket_days = self.BUCKET_DAYS.get(bucket)
+        data_from = lower if bucket_days is None else lower - datetime.timedelta(days=max(self.ROLLING_WINDOWS) - 1)
+        b = self._get_buckets(bucket, data_from, upper, **kwargs).c
+
+        columns = [b.team_id, b.bucket, b.rows_count.label("count")]
+        for metric in self.METRICS:
+            columns += [
+                (cast(b[f"{metric}_sum"], Float) / b.rows_count).label(f"{metric}_avg"),
+                b[f"{metric}_min"],
+                b[f"{metric}_max"],
+            ]
+            for days in self.ROLLING_WINDOWS:
+                if bucket_days is None:
+                    total, count = b[f"{metric}_sum_{days}d"], b[f"rows_count_{days}d"]
+                else:
+                    window = {
+                        "partition_by": b.team_id,
+                        "order_by": b.bucket - literal(self.EPOCH, Date),  # RANGE offsets need a number
+                        "range_": (bucket_days - days, 0),
+                    }
+                    total, count = func.sum(b[f"{metric}_sum"]).over(**window), func.sum(b.rows_count).over(**window)
+                columns.append((cast(total, Float) / func.nullif(count, 0)).label(f"{metric}_avg_{days}d"))
+        aggregates = select(columns).subquery("aggregates")
+
+        q = select(aggregates).where(aggregates.c.bucket >= lower).order_by(aggregates.c.team_id, aggregates.c.bucket)
+        return await self.get_entities_by_query(q)
+
+    def get_export_query(self, **kwargs) -> select:
+        t = self.table_model
+        columns = {"team": team.c.name, "date": t.c.date, "review_time": t.c.review_time, "merge_time": t.c.merge_time}
+        q = select([columns[name].label(name) for name in self.EXPORT_COLUMNS])
+        q = q.select_from(t.join(team, team.c.id == t.c.team_id))
+        return self.filters(q, **kwargs).order_by(t.c.team_id, t.c.date)
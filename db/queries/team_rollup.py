@@ -0,0 +1,51 @@
+import datetime
+from collections.abc import Sequence
+
+from sqlalchemy import Column
+
+from core.contexts import PROJECT_ID
+from db.models import team_data
+from db.queries.base import BaseQuery
+
+
+class TeamRollupQuery(BaseQuery):
+
+    METRICS = ("review_time", "merge_time")
+
+    @property
+    def bucket(self) -> str:
+        return self.table_model.info["bucket"]
+
+    @property
+    def rolling_windows(self) -> tuple[int, ...]:
+        return self.table_model.info["rolling_windows"]
+
+    def _get_aggregates(self) -> dict[str, str]:
+        aggregates = {"rows_count": "count(*)"}
+        for metric in self.METRICS:
+            for aggregate in ("sum", "min", "max"):
+                aggregates[f"{metric}_{aggregate}"] = f"{aggregate}(data.{metric})"
+        for days in self.rolling_windows:
+            tail = f"data.date >= touched.bucket + INTERVAL '1 {self.bucket}' - INTERVAL '{days} days'"
+            aggregates[f"rows_count_{days}d"] = f"count(*) FILTER (WHERE {tail})"
+            for metric in self.METRICS:
+                aggregates[f"{metric}_sum_{days}d"] = f"sum(data.{metric}) FILTER (WHERE {tail})"
+        return aggregates
+
+    def get_aggregate_columns(self) -> list[Column]:
+        return [self.table_model.c[column] for column in self._get_aggregates()]
+
+    async def refresh(self, team_ids: Sequence[int], buckets: Sequence[datetime.date]) -> None:
+        table, aggregates = self.table_model.name, self._get_aggregates()
+        q = f"""
+            INSERT INTO {table} (team_id, project_id, bucket, {", ".join(aggregates)})
+            SELECT touched.team_id, :project_id, touched.bucket, {", ".join(aggregates.values())}
+            FROM unnest(CAST(:team_ids AS INTEGER[]), CAST(:buckets AS DATE[])) AS touched (team_id, bucket)
+            JOIN {team_data.name} AS data ON data.team_id = touched.team_id
+                AND data.date >= touched.bucket AND data.date < touched.bucket + INTERVAL '1 {self.bucket}'
+            GROUP BY touched.team_id, touched.bucket
+            ON CONFLICT ON CONSTRAINT {table}_unique DO UPDATE
+            SET {", ".join(f"{column} = EXCLUDED.{column}" for column in aggregates)}, modified = now()
+        """
+        values = {"team_ids": list(team_ids), "buckets": list(buckets), "project_id": PROJECT_ID.get()}
+        await self.conn.execute(q, values=values)
@@ -0,0 +1,74 @@
+from collections.abc import Mapping
+
+import numpy
+
+from db.queries.base import BaseQuery
+
+
+class TeamStatsQuery(BaseQuery):
+    METRICS = ("review_time", "merge_time")
+
+    # how existing stats are combined with stats of a delta
+    COMBINE = {
+        "sum": "{table}.{column} + EXCLUDED.{column}",
+        "min": "LEAST({table}.{column}, EXCLUDED.{column})",
+        "max": "GREATEST({table}.{column}, EXCLUDED.{column})",
+    }
+    REDUCERS = {"sum": numpy.add, "min": numpy.minimum, "max": numpy.maximum}
+
+    def _get_aggregates(self) -> dict[str, tuple[str, str]]:
+        aggregates = {"rows_count": ("count(*)", "sum")}
+        for metric in self.METRICS:
+            for aggregate in ("sum", "min", "max"):
+                aggregates[f"{metric}_{aggregate}"] = (f"{aggregate}({metric})", aggregate)
+        aggregates["first_date"] = ("min(date)", "min")
+        aggregates["last_date"] = ("max(date)", "max")
+        return aggregates
+
+    def _get_conflict_sql(self, replace: bool) -> str:
+        table = self.table_model.name
+        assignments = [
+            f"{column} = EXCLUDED.{column}"
+            if replace
+            else f"{column} = {self.COMBINE[combine]}".format(table=table, column=column)
+            for column, (_, combine) in self._get_aggregates().items()
+        ]
+        return f"""
+            ON CONFLICT (team_id) DO UPDATE
+            SET {", ".join(assignments)}, last_import_id = EXCLUDED.last_import_id, modified = now()
+        """
+
+    def get_upsert_sql(self, source: str, where: str = "TRUE", replace: bool = False) -> str:
+        """Statement writing stats of rows selected from `source`, which has `team_data` columns."""
+        table, aggregates = self.table_model.name, self._get_aggregates()
+        return f"""
+            INSERT INTO {table} (team_id, project_id, {", ".join(aggregates)}, last_import_id)
+            SELECT team_id, :project_id, {", ".join(aggregate for aggregate, _ in aggregates.values())}, :import_id
+            FROM {source}
+            WHERE {where}
+            GROUP BY team_id
+            {self._get_conflict_sql(replace)}
+        """
+
+    def get_add_sql(self) -> str:
+        table, columns = self.table_model.name, ["team_id", *self._get_aggregates()]
+        arrays = ", ".join(f"CAST(:{column} AS {self.table_model.c[column].type}[])" for column in columns)
+        return f"""
+            INSERT INTO {table} ({", ".join(columns)}, project_id, last_import_id)
+            SELECT {", ".join(columns)}, :project_id, :import_id
+            FROM unnest({arrays}) AS delta ({", ".join(columns)})
+            {self._get_conflict_sql(replace=False)}
+        """
+
+    def get_deltas(self, columns: Mapping[str, numpy.ndarray]) -> dict[str, list]:
+        order = numpy.argsort(columns["team_id"], kind="stable")
+        team_ids, starts = numpy.unique(columns["team_id"][order], return_index=True)
+        deltas = {"team_id": team_ids, "rows_count": numpy.diff(starts, append=len(order))}
+        for metric in self.METRICS:
+            values = columns[metric].astype(numpy.int64)[order]
+            for aggregate, reducer in self.REDUCERS.items():
+                deltas[f"{metric}_{aggregate}"] = reducer.reduceat(values, starts)
+        dates = columns["date"].astype("datetime64[D]")[order]
+        deltas["first_date"] = numpy.minimum.reduceat(dates, starts)
+        deltas["last_date"] = numpy.maximum.reduceat(dates, starts)
+        return {column: values.tolist() for column, values in deltas.items()}
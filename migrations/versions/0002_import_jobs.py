@@ -0,0 +1,39 @@
+"""import jobs
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 01:31:52.613208
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("imports", sa.Column("mode", sa.String(length=16), server_default="create", nullable=False))
+    op.add_column("imports", sa.Column("status", sa.String(length=16), server_default="finished", nullable=False))
+    op.add_column("imports", sa.Column("inserted", sa.Integer(), nullable=True))
+    op.add_column("imports", sa.Column("updated", sa.Integer(), nullable=True))
+    op.add_column("imports", sa.Column("unchanged", sa.Integer(), nullable=True))
+    op.add_column("imports", sa.Column("error", postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+    op.add_column("imports", sa.Column("started", sa.DateTime(), nullable=True))
+    op.add_column("imports", sa.Column("finished", sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("imports", "finished")
+    op.drop_column("imports", "started")
+    op.drop_column("imports", "error")
+    op.drop_column("imports", "unchanged")
+    op.drop_column("imports", "updated")
+    op.drop_column("imports", "inserted")
+    op.drop_column("imports", "status")
+    op.drop_column("imports", "mode")
@@ -0,0 +1,23 @@
+"""team data project date index
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 01:37:10.280447
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("team_data_project_id_date_idx", "team_data", ["project_id", "date"], unique=False)
+
+
+def downgrade():
+    op.drop_index("team_data_project_id_date_idx", table_name="team_data")
@@ -0,0 +1,61 @@
+"""team stats rollups
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 01:40:05.941672
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("team_stats", sa.Column("rows_count", sa.Integer(), server_default="0", nullable=False))
+    op.add_column("team_stats", sa.Column("review_time_sum", sa.BigInteger(), nullable=True))
+    op.add_column("team_stats", sa.Column("review_time_min", sa.Integer(), nullable=True))
+    op.add_column("team_stats", sa.Column("review_time_max", sa.Integer(), nullable=True))
+    op.add_column("team_stats", sa.Column("merge_time_sum", sa.BigInteger(), nullable=True))
+    op.add_column("team_stats", sa.Column("merge_time_min", sa.Integer(), nullable=True))
+    op.add_column("team_stats", sa.Column("merge_time_max", sa.Integer(), nullable=True))
+    op.add_column("team_stats", sa.Column("first_date", sa.Date(), nullable=True))
+    op.add_column("team_stats", sa.Column("last_date", sa.Date(), nullable=True))
+    op.add_column("team_stats", sa.Column("last_import_id", sa.Integer(), nullable=True))
+    op.create_foreign_key("last_import_id_fk", "team_stats", "imports", ["last_import_id"], ["id"], ondelete="SET NULL")
+    op.execute(
+        """
+        INSERT INTO team_stats (
+            team_id, project_id, rows_count,
+            review_time_sum, review_time_min, review_time_max,
+            merge_time_sum, merge_time_min, merge_time_max,
+            first_date, last_date
+        )
+        SELECT
+            team_id, min(project_id), count(*),
+            sum(review_time), min(review_time), max(review_time),
+            sum(merge_time), min(merge_time), max(merge_time),
+            min(date), max(date)
+        FROM team_data
+        GROUP BY team_id
+        """
+    )
+
+
+def downgrade():
+    op.drop_constraint("last_import_id_fk", "team_stats", type_="foreignkey")
+    op.drop_column("team_stats", "last_import_id")
+    op.drop_column("team_stats", "last_date")
+    op.drop_column("team_stats", "first_date")
+    op.drop_column("team_stats", "merge_time_max")
+    op.drop_column("team_stats", "merge_time_min")
+    op.drop_column("team_stats", "merge_time_sum")
+    op.drop_column("team_stats", "review_time_max")
+    op.drop_column("team_stats", "review_time_min")
+    op.drop_column("team_stats", "review_time_sum")
+    op.drop_column("team_stats", "rows_count")
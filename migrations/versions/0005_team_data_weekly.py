@@ -0,0 +1,62 @@
+"""team data weekly
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 01:42:18.125903
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "team_data_weekly",
+        sa.Column("id", sa.Integer(), sa.Identity(always=True), nullable=False),
+        sa.Column("team_id", sa.Integer(), nullable=False),
+        sa.Column("project_id", sa.SMALLINT(), nullable=False),
+        sa.Column("bucket", sa.Date(), nullable=False),
+        sa.Column("rows_count", sa.Integer(), nullable=False),
+        sa.Column("review_time_sum", sa.BigInteger(), nullable=False),
+        sa.Column("review_time_min", sa.Integer(), nullable=False),
+        sa.Column("review_time_max", sa.Integer(), nullable=False),
+        sa.Column("merge_time_sum", sa.BigInteger(), nullable=False),
+        sa.Column("merge_time_min", sa.Integer(), nullable=False),
+        sa.Column("merge_time_max", sa.Integer(), nullable=False),
+        sa.Column("created", sa.DateTime(), server_default=sa.text("now()"), nullable=True),
+        sa.Column("modified", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["project_id"], ["project.id"], name="project_id_fk", ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["team_id"], ["team.id"], name="team_id_fk", ondelete="RESTRICT"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("team_id", "bucket", name="team_data_weekly_unique"),
+    )
+    op.create_index(
+        "team_data_weekly_project_id_bucket_idx", "team_data_weekly", ["project_id", "bucket"], unique=False
+    )
+    op.execute(
+        """
+        INSERT INTO team_data_weekly (
+            team_id, project_id, bucket, rows_count,
+            review_time_sum, review_time_min, review_time_max,
+            merge_time_sum, merge_time_min, merge_time_max
+        )
+        SELECT
+            team_id, min(project_id), CAST(date_trunc('week', date) AS DATE), count(*),
+            sum(review_time), min(review_time), max(review_time),
+            sum(merge_time), min(merge_time), max(merge_time)
+        FROM team_data
+        GROUP BY team_id, date_trunc('week', date)
+        """
+    )
+
+
+def downgrade():
+    op.drop_index("team_data_weekly_project_id_bucket_idx", table_name="team_data_weekly")
+    op.drop_table("team_data_weekly")
@@ -0,0 +1,76 @@
+"""team data monthly
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 01:42:55.718364
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "team_data_monthly",
+        sa.Column("id", sa.Integer(), sa.Identity(always=True), nullable=False),
+        sa.Column("team_id", sa.Integer(), nullable=False),
+        sa.Column("project_id", sa.SMALLINT(), nullable=False),
+        sa.Column("bucket", sa.Date(), nullable=False),
+        sa.Column("rows_count", sa.Integer(), nullable=False),
+        sa.Column("review_time_sum", sa.BigInteger(), nullable=False),
+        sa.Column("review_time_min", sa.Integer(), nullable=False),
+        sa.Column("review_time_max", sa.Integer(), nullable=False),
+        sa.Column("merge_time_sum", sa.BigInteger(), nullable=False),
+        sa.Column("merge_time_min", sa.Integer(), nullable=False),
+        sa.Column("merge_time_max", sa.Integer(), nullable=False),
+        sa.Column("rows_count_7d", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("review_time_sum_7d", sa.BigInteger(), nullable=True),
+        sa.Column("merge_time_sum_7d", sa.BigInteger(), nullable=True),
+        sa.Column("rows_count_28d", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("review_time_sum_28d", sa.BigInteger(), nullable=True),
+        sa.Column("merge_time_sum_28d", sa.BigInteger(), nullable=True),
+        sa.Column("created", sa.DateTime(), server_default=sa.text("now()"), nullable=True),
+        sa.Column("modified", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["project_id"], ["project.id"], name="project_id_fk", ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["team_id"], ["team.id"], name="team_id_fk", ondelete="RESTRICT"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("team_id", "bucket", name="team_data_monthly_unique"),
+    )
+    op.create_index(
+        "team_data_monthly_project_id_bucket_idx", "team_data_monthly", ["project_id", "bucket"], unique=False
+    )
+    op.execute(
+        """
+        INSERT INTO team_data_monthly (
+            team_id, project_id, bucket, rows_count,
+            review_time_sum, review_time_min, review_time_max,
+            merge_time_sum, merge_time_min, merge_time_max,
+            rows_count_7d, review_time_sum_7d, merge_time_sum_7d,
+            rows_count_28d, review_time_sum_28d, merge_time_sum_28d
+        )
+        SELECT
+            team_id, min(project_id), CAST(date_trunc('month', date) AS DATE), count(*),
+            sum(review_time), min(review_time), max(review_time),
+            sum(merge_time), min(merge_time), max(merge_time),
+            count(*) FILTER (WHERE date >= date_trunc('month', date) + INTERVAL '1 month' - INTERVAL '7 days'),
+            sum(review_time) FILTER (WHERE date >= date_trunc('month', date) + INTERVAL '1 month' - INTERVAL '7 days'),
+            sum(merge_time) FILTER (WHERE date >= date_trunc('month', date) + INTERVAL '1 month' - INTERVAL '7 days'),
+            count(*) FILTER (WHERE date >= date_trunc('month', date) + INTERVAL '1 month' - INTERVAL '28 days'),
+            sum(review_time) FILTER (WHERE date >= date_trunc('month', date) + INTERVAL '1 month' - INTERVAL '28 days'),
+            sum(merge_time) FILTER (WHERE date >= date_trunc('month', date) + INTERVAL '1 month' - INTERVAL '28 days')
+        FROM team_data
+        GROUP BY team_id, date_trunc('month', date)
+        """
+    )
+
+
+def downgrade():
+    op.drop_index("team_data_monthly_project_id_bucket_idx", table_name="team_data_monthly")
+    op.drop_table("team_data_monthly")
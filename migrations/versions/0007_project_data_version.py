@@ -0,0 +1,24 @@
+"""project data version
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 01:44:31.062185
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("project", sa.Column("data_version", sa.BigInteger(), server_default="0", nullable=False))
+
+
+def downgrade():
+    op.drop_column("project", "data_version")
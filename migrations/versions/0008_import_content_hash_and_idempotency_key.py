@@ -0,0 +1,32 @@
+"""import content hash and idempotency key
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17 02:28:28.154864
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("imports", sa.Column("content_hash", sa.String(length=64), nullable=True))
+    op.add_column("imports", sa.Column("idempotency_key", sa.String(length=255), nullable=True))
+    op.create_index("imports_project_id_content_hash_idx", "imports", ["project_id", "content_hash"], unique=False)
+    op.create_index(
+        "imports_project_id_idempotency_key_idx", "imports", ["project_id", "idempotency_key"], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index("imports_project_id_idempotency_key_idx", table_name="imports")
+    op.drop_index("imports_project_id_content_hash_idx", table_name="imports")
+    op.drop_column("imports", "idempotency_key")
+    op.drop_column("imports", "content_hash")
@@ -0,0 +1,48 @@
+"""import idempotency key unique
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17 03:38:14.507826
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # concurrent requests could have taken the same key, the latest import keeps it like it does for replays
+    op.execute(
+        """
+        UPDATE imports SET idempotency_key = NULL
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT id, row_number() OVER (PARTITION BY project_id, idempotency_key ORDER BY id DESC) AS n
+                FROM imports
+                WHERE idempotency_key IS NOT NULL AND status != 'failed'
+            ) AS keyed
+            WHERE n > 1
+        )
+        """
+    )
+    op.drop_index("imports_project_id_idempotency_key_idx", table_name="imports")
+    op.create_index(
+        "imports_project_id_idempotency_key_idx",
+        "imports",
+        ["project_id", "idempotency_key"],
+        unique=True,
+        postgresql_where=sa.text("idempotency_key IS NOT NULL AND status != 'failed'"),
+    )
+
+
+def downgrade():
+    op.drop_index("imports_project_id_idempotency_key_idx", table_name="imports")
+    op.create_index(
+        "imports_project_id_idempotency_key_idx", "imports", ["project_id", "idempotency_key"], unique=False
+    )
@@ -1,13 +1,40 @@
+from collections.abc import AsyncIterator
+
 from fastapi import Header
+from fastapi import Request
 
+from apps.entities.imports.schemas import ImportFormat
+from apps.entities.imports.validator import ImportValidator
+from apps.entities.imports.validator import read_gzip
+from apps.entities.projects.managers import ProjectManager
 from core.contexts import PROJECT_ID
 from core.exceptions import BadRequestException
-from core.settings.projects import PROJECTS
+from core.exceptions import UnsupportedMediaTypeException
 from core.types import EntityId
 
 
 async def project_id_for_rest(project_id: EntityId = Header()):
-    if project_id not in PROJECTS:  # let's imagine that we cached projects from the database to this variable
+    if not await ProjectManager().is_exists(project_id):
         raise BadRequestException(detail="Invalid project_id")
     PROJECT_ID.set(project_id)
     return project_id
+
+
+async def import_format(content_type: str = Header()) -> ImportFormat:
+    try:
+        return ImportFormat(content_type.split(";")[0].strip().lower())
+    except ValueError:
+        raise UnsupportedMediaTypeException(detail=f"Content-Type must be one of {', '.join(ImportFormat)}")
+
+
+async def request_body(
+    request: Request,
+    content_encoding: str = Header("identity"),
+) -> AsyncIterator[bytes]:
+    """Body of the request read as it arrives, a gzip `Content-Encoding` is decompressed on the fly."""
+    match content_encoding.strip().lower():
+        case "identity":
+            return request.stream()
+        case "gzip" | "x-gzip":
+            return read_gzip(request.stream(), ImportValidator.block_size)
+    raise UnsupportedMediaTypeException(detail="Content-Encoding must be gzip or identity")
@@ -1,23 +1,32 @@
 import asyncio
+import logging
 
-from brotli_asgi import BrotliMiddleware
 from fastapi import FastAPI
 from fastapi import HTTPException
 
+from apps.entities.imports.managers import ImportManager
+from apps.entities.projects.managers import ProjectManager
 from core.utils import set_max_workers_for_loop
+from core.utils import shutdown_process_pools
 from db import get_database
+from services.api.middlewares import CompressionMiddleware
 from services.api.utils import ORJSONResponse
+from services.api.v1.stats.endpoints import router as stats_router
 from services.api.v1.team_data.endpoints import router
+from services.api.v1.team_metrics.endpoints import router as team_metrics_router
 
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     default_response_class=ORJSONResponse,
     docs_url="/core/public/v1/docs",
     openapi_url="/core/public/v1/openapi.json",
 )
-app.add_middleware(BrotliMiddleware)
+app.add_middleware(CompressionMiddleware)
 
 app.include_router(router, prefix="/import", tags=["import"])
+app.include_router(team_metrics_router, prefix="/metrics", tags=["metrics"])
+app.include_router(stats_router, prefix="/stats", tags=["stats"])
 
 
 @app.exception_handler(HTTPException)
@@ -35,3 +44,15 @@ async def validation_exception_handler(request, exc):
 async def startup():
     set_max_workers_for_loop(asyncio.get_running_loop())
     await get_database().connect()
+    try:
+        await ProjectManager().load_ids()
+    except Exception:
+        logger.exception("Project ids are not loaded, the first request loads them")
+    ProjectManager.start_listening()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await ProjectManager.stop_listening()
+    await ImportManager.cancel_jobs()
+    shutdown_process_pools()
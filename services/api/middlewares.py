@@ -0,0 +1,211 @@
+import time
+import zlib
+from collections import OrderedDict
+
+import brotli
+from starlette import status
+from starlette.datastructures import Headers
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp
+from starlette.types import Message
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
+
+from core.settings import CompressionConfig
+from core.settings import CompressionProfile
+
+try:
+    import zstandard
+except ImportError:  # zstd is offered only if the optional `zstandard` is installed
+    zstandard = None
+
+
+class GzipCompressor:
+    LEVELS = {CompressionProfile.fast: 1, CompressionProfile.default: 6}
+
+    def __init__(self, profile: CompressionProfile):
+        self._compressor = zlib.compressobj(self.LEVELS[profile], zlib.DEFLATED, 31)  # 31 is the gzip container
+
+    def compress(self, data: bytes, finish: bool = False) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_FINISH if finish else zlib.Z_SYNC_FLUSH)
+
+
+class BrotliCompressor:
+    LEVELS = {CompressionProfile.fast: 1, CompressionProfile.default: 5}
+
+    def __init__(self, profile: CompressionProfile):
+        self._compressor = brotli.Compressor(quality=self.LEVELS[profile])
+
+    def compress(self, data: bytes, finish: bool = False) -> bytes:
+        return self._compressor.process(data) + (self._compressor.finish() if finish else self._compressor.flush())
+
+
+class ZstdCompressor:
+    LEVELS = {CompressionProfile.fast: 1, CompressionProfile.default: 3}
+
+    def __init__(self, profile: CompressionProfile):
+        self._compressor = zstandard.ZstdCompressor(level=self.LEVELS[profile]).compressobj()
+
+    def compress(self, data: bytes, finish: bool = False) -> bytes:
+        flush_mode = zstandard.COMPRESSOBJ_FLUSH_FINISH if finish else zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        return self._compressor.compress(data) + self._compressor.flush(flush_mode)
+
+
+# in the order of preference, when the client accepts them equally
+COMPRESSORS = {
+    **({"zstd": ZstdCompressor} if zstandard is not None else {}),
+    "br": BrotliCompressor,
+    "gzip": GzipCompressor,
+}
+
+
+def get_encoding(accept_encoding: str) -> str | None:
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, *params = (part.strip() for part in item.split(";"))
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    encodings = [encoding for encoding in COMPRESSORS if qualities.get(encoding, qualities.get("*", 0)) > 0]
+    return max(encodings, key=lambda encoding: qualities.get(encoding, qualities.get("*")), default=None)
+
+
+class CompressionStats:
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.responses = 0  # compressed responses
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_time = 0.0  # seconds spent on compression
+        self.cache_hits = 0
+        self.cpu_time_saved = 0.0  # seconds of compression skipped by cache hits
+
+    def get_stats(self) -> dict[str, int | float]:
+        return {**vars(self), "bytes_saved": self.bytes_in - self.bytes_out}
+
+
+compression_stats = CompressionStats()
+
+
+class CompressionMiddleware:
+    """Compression of responses negotiated from `Accept-Encoding`, with a level chosen by the media type."""
+
+    def __init__(self, app: ASGIApp, config: CompressionConfig | None = None) -> None:
+        self.app = app
+        self.config = config or CompressionConfig.get_default()
+        # (path, query, ETag, encoding) -> (checksum of the body, compressed body, CPU time of compression)
+        self._cache: OrderedDict[tuple, tuple[int, bytes, float]] = OrderedDict()
+        self._cache_size = 0  # bytes of the cached bodies
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and (encoding := get_encoding(Headers(scope=scope).get("accept-encoding", ""))):
+            await CompressionResponder(self, scope, encoding, send)(receive)
+            return
+        await self.app(scope, receive, send)
+
+    def get_profile(self, start_message: Message) -> CompressionProfile | None:
+        headers = Headers(raw=start_message["headers"])
+        if "content-encoding" in headers or start_message["status"] in (
+            status.HTTP_204_NO_CONTENT,
+            status.HTTP_304_NOT_MODIFIED,
+        ):
+            return None
+        return self.config.profiles.get(headers.get("content-type", "").split(";")[0].strip().lower())
+
+    def get_cached(self, key: tuple, body: bytes) -> bytes | None:
+        checksum, compressed, cpu_time = self._cache.get(key, (None, None, 0.0))
+        if compressed is None or checksum != zlib.crc32(body):
+            return None
+        self._cache.move_to_end(key)
+        compression_stats.cache_hits += 1
+        compression_stats.cpu_time_saved += cpu_time
+        return compressed
+
+    def set_cached(self, key: tuple, body: bytes, compressed: bytes, cpu_time: float) -> None:
+        if len(compressed) > self.config.cache_size:
+            return
+        if (cached := self._cache.pop(key, None)) is not None:
+            self._cache_size -= len(cached[1])
+        self._cache[key] = (zlib.crc32(body), compressed, cpu_time)
+        self._cache_size += len(compressed)
+        while self._cache_size > self.config.cache_size:
+            self._cache_size -= len(self._cache.popitem(last=False)[1][1])
+
+
+class CompressionResponder:
+    def __init__(self, middleware: CompressionMiddleware, scope: Scope, encoding: str, send: Send) -> None:
+        self.middleware = middleware
+        self.scope = scope
+        self.encoding = encoding
+        self.send = send
+        self.start_message: Message | None = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def __call__(self, receive: Receive) -> None:
+        await self.middleware.app(self.scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self.start_message = message  # headers are sent with the first body
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body, more_body = message.get("body", b""), message.get("more_body", False)
+        if self.compressor is not None:
+            await self.send({**message, "body": self._compress(body, finish=not more_body)})
+            return
+
+        profile = self.middleware.get_profile(self.start_message)
+        if profile is None or (len(body) < self.middleware.config.minimum_size and not more_body):
+            self.passthrough = True
+            await self.send(self.start_message)
+            await self.send(message)
+            return
+
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        self.compressor = COMPRESSORS[self.encoding](profile)
+        if more_body:
+            del headers["Content-Length"]
+            body = self._compress(body)
+        else:
+            body = self._compress_cached(body, headers.get("etag"))
+            headers["Content-Length"] = str(len(body))
+        await self.send(self.start_message)
+        await self.send({**message, "body": body})
+
+    def _compress(self, body: bytes, finish: bool = False) -> bytes:
+        started = time.thread_time()
+        compressed = self.compressor.compress(body, finish=finish)
+        compression_stats.cpu_time += time.thread_time() - started
+        compression_stats.responses += finish
+        compression_stats.bytes_in += len(body)
+        compression_stats.bytes_out += len(compressed)
+        return compressed
+
+    def _compress_cached(self, body: bytes, etag: str | None) -> bytes:
+        if etag is None or self.start_message["status"] != status.HTTP_200_OK:
+            return self._compress(body, finish=True)
+        key = (self.scope["path"], self.scope["query_string"], etag, self.encoding)
+        if (compressed := self.middleware.get_cached(key, body)) is not None:
+            compression_stats.responses += 1
+            compression_stats.bytes_in += len(body)
+            compression_stats.bytes_out += len(compressed)
+            return compressed
+        cpu_time = compression_stats.cpu_time
+        compressed = self._compress(body, finish=True)
+        self.middleware.set_cached(key, body, compressed, compression_stats.cpu_time - cpu_time)
+        return compressed
@@ -0,0 +1,75 @@
+from pathlib import Path
+
+import pytest
+from starlette import status
+
+from core.settings import CompressionConfig
+from services.api.main import app
+from services.api.middlewares import compression_stats
+from services.api.middlewares import CompressionMiddleware
+from services.api.middlewares import COMPRESSORS
+from services.api.middlewares import get_encoding
+
+FILES_DIR = Path(__file__).resolve().parent.joinpath("test_files")
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, expected",
+    [
+        ("gzip, deflate, br", "br"),
+        ("br;q=0.5, gzip", "gzip"),
+        ("gzip;q=0, br;q=0", None),
+        ("identity", None),
+        ("*", next(iter(COMPRESSORS))),  # zstd if it is installed
+        ("", None),
+    ],
+)
+def test_get_encoding(accept_encoding, expected):
+    assert get_encoding(accept_encoding) == expected
+
+
+async def test_compression(client):
+    files = {"file": open(FILES_DIR.joinpath("data.csv"), "rb")}
+    await client.post(app.url_path_for("import_create"), files=files)
+    compression_stats.clear()
+
+    response = await client.get(app.url_path_for("team_summary_get", team_id=999999), headers={"Accept-Encoding": "br"})
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert "content-encoding" not in response.headers  # too small to be worth it
+
+    url = app.url_path_for("team_metrics_get")
+    params = {"date_from": "2023-01-01", "date_to": "2023-12-31"}
+    responses = [await client.get(url, params=params, headers={"Accept-Encoding": "gzip"}) for _ in range(2)]
+    assert {response.headers["content-encoding"] for response in responses} == {"gzip"}
+    assert responses[0].json() == responses[1].json()
+    assert responses[0].headers["vary"] == "Accept-Encoding"
+    stats = compression_stats.get_stats()
+    assert (stats["responses"], stats["cache_hits"]) == (2, 1)  # the second response has the same ETag
+    assert 0 < stats["bytes_out"] < stats["bytes_in"]
+    assert stats["bytes_saved"] == stats["bytes_in"] - stats["bytes_out"]
+    response = await client.get(app.url_path_for("stats_get"))
+    assert response.json()["compression"] == stats
+
+
+def test_compression_cache_size():
+    middleware = CompressionMiddleware(app, CompressionConfig(cache_size=10))
+    middleware.set_cached("a", b"a", b"a" * 4, 0.0)
+    middleware.set_cached("b", b"b", b"b" * 4, 0.0)
+    middleware.set_cached("a", b"a", b"a" * 4, 0.0)  # replaced, and used more recently than "b"
+    middleware.set_cached("c", b"c", b"c" * 4, 0.0)
+    middleware.set_cached("d", b"d", b"d" * 11, 0.0)  # larger than the whole cache
+    assert [key for key in middleware._cache] == ["a", "c"]
+    assert middleware._cache_size == 8
+
+
+async def test_compression_zstd(client):
+    zstandard = pytest.importorskip("zstandard")
+    files = {"file": open(FILES_DIR.joinpath("data.csv"), "rb")}
+    await client.post(app.url_path_for("import_create"), files=files)
+
+    url = app.url_path_for("team_data_export")
+    headers = {"Accept-Encoding": "zstd, br;q=0.9"}
+    response = await client.get(url, headers=headers)
+    assert response.headers["content-encoding"] == "zstd"
+    body = zstandard.ZstdDecompressor().decompressobj().decompress(response.content)
+    assert body == (await client.get(url)).content
@@ -1,10 +1,38 @@
+import asyncio
+import datetime
+import gzip
+import hashlib
+import io
+from contextlib import nullcontext
 from pathlib import Path
 
+import pandas
+import pydantic
 import pytest
+from redis.exceptions import ConnectionError
+from redis.exceptions import LockError
 from starlette import status
 
+from apps.entities.imports.managers import ImportManager
+from apps.entities.imports.schemas import ImportFormat
+from apps.entities.imports.schemas import ImportMode
+from apps.entities.imports.schemas import ImportStatus
+from apps.entities.imports.schemas import TeamMetricCSV
+from apps.entities.imports.validator import ChunkError
+from apps.entities.imports.validator import ImportErrors
+from apps.entities.imports.validator import ImportValidator
+from apps.entities.imports.validator import parse_chunk
+from apps.entities.teams.cache import TeamIdsCache
 from apps.entities.teams.managers import TeamDataManager
 from apps.entities.teams.managers import TeamManager
+from core.redis import redis_client
+from core.redis import RedisLockClient
+from core.redis import RenewableLock
+from core.settings import ImportConfig
+from core.settings import ImportExecutor
+from core.settings import ImportLockScope
+from core.utils import get_process_pool
+from core.utils import shutdown_process_pools
 from services.api.main import app
 
 
@@ -24,3 +52,492 @@ async def test_invalid_import(client, filename: str):
     files = {"file": open(FILES_DIR.joinpath(filename), "rb")}
     response = await client.post(app.url_path_for("import_create"), files=files)
     assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.parametrize("executor", list(ImportExecutor))
+async def test_import_in_chunks(client, monkeypatch, executor: ImportExecutor):
+    monkeypatch.setattr(ImportValidator, "block_size", 100)
+    monkeypatch.setattr(ImportValidator, "executor", executor)
+    files = {"file": open(FILES_DIR.joinpath("data.csv"), "rb")}
+    response = await client.post(app.url_path_for("import_create"), files=files)
+    assert response.status_code == status.HTTP_201_CREATED
+    assert await TeamDataManager().queries.get_count() == 96
+
+    if executor == ImportExecutor.process:
+        processes = list(get_process_pool(ImportValidator.workers)._processes.values())
+        shutdown_process_pools()
+        assert processes and not any(process.is_alive() for process in processes)
+
+
+async def test_import_team_stats(client, monkeypatch):
+    monkeypatch.setattr(ImportValidator, "block_size", 100)
+    files = {"file": open(FILES_DIR.joinpath("data.csv"), "rb")}
+    response = await client.post(app.url_path_for("import_create"), files=files)
+    assert response.status_code == status.HTTP_201_CREATED
+    queries, columns = TeamDataManager().queries, ["team_id", *TeamDataManager().queries.stats._get_aggregates()]
+    added = await queries.stats.get_entities(order_by=["team_id"], return_fields=columns)
+    assert sum(stats["rows_count"] for stats in added) == 96
+
+    import_id = (await ImportManager().queries.get_entity())["id"]
+    await queries.recompute_stats({stats["team_id"] for stats in added}, import_id)
+    assert await queries.stats.get_entities(order_by=["team_id"], return_fields=columns) == added
+
+
+async def test_import_conflict(client):
+    data = FILES_DIR.joinpath("data.csv").read_bytes()
+    # the trailing blank line makes the file differ from the imported one, not to be taken for a repeated upload
+    for content, status_code in ((data, status.HTTP_201_CREATED), (data + b"\n", status.HTTP_409_CONFLICT)):
+        response = await client.post(app.url_path_for("import_create"), files={"file": ("data.csv", content)})
+        assert response.status_code == status_code
+    assert await TeamDataManager().queries.get_count() == 96
+
+
+async def test_import_deduplicated(client):
+    data = FILES_DIR.joinpath("data.csv").read_bytes()
+    responses = [
+        await client.post(app.url_path_for("import_create"), files={"file": ("data.csv", data)}) for _ in range(2)
+    ]
+    assert [response.status_code for response in responses] == [status.HTTP_201_CREATED] * 2
+    assert responses[0].json() == responses[1].json() == {"inserted": 96, "updated": 0, "unchanged": 0}
+    import_ = await ImportManager().queries.get_entity(filters={"filename": "data.csv"})
+    assert import_["content_hash"] == hashlib.sha256(data).hexdigest()
+
+    response = await client.post(app.url_path_for("import_job_create"), files={"file": ("data.csv", data)})
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert (response.json()["id"], response.json()["status"]) == (import_["id"], ImportStatus.finished)
+    assert await ImportManager().queries.get_count() == 1
+
+    # once data has changed, the same file is imported again
+    response = await client.post(
+        app.url_path_for("import_create"),
+        files={"file": ("new.csv", b"review_time,team,date,merge_time\n1,new,2023-01-01,1\n")},
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    response = await client.post(app.url_path_for("import_create"), files={"file": ("data.csv", data)})
+    assert response.status_code == status.HTTP_409_CONFLICT
+
+
+async def test_import_idempotency_key(client):
+    data = FILES_DIR.joinpath("data.csv").read_bytes()
+    url, headers = app.url_path_for("import_raw_create"), {"Content-Type": "text/csv", "Idempotency-Key": "retry"}
+    responses = [await client.post(url, content=data, headers=headers) for _ in range(2)]
+    assert [response.status_code for response in responses] == [status.HTTP_201_CREATED] * 2
+    assert responses[0].json() == responses[1].json() == {"inserted": 96, "updated": 0, "unchanged": 0}
+    import_ = await ImportManager().queries.get_entity(filters={"idempotency_key": "retry"})
+    assert import_["content_hash"] == hashlib.sha256(data).hexdigest()  # computed while the body was streamed
+
+    response = await client.post(
+        app.url_path_for("import_job_create"), files={"file": ("other.csv", b"")}, headers={"Idempotency-Key": "retry"}
+    )
+    assert response.json()["id"] == import_["id"]
+    assert await ImportManager().queries.get_count() == 1
+
+    await ImportManager().queries.create(
+        project_id=1, filename="data.csv", status=ImportStatus.processing, idempotency_key="running"
+    )
+    response = await client.post(url, content=data, headers={**headers, "Idempotency-Key": "running"})
+    assert response.status_code == status.HTTP_409_CONFLICT
+
+
+async def test_import_idempotency_key_interrupted(client):
+    import_ = await ImportManager().queries.create(
+        project_id=1,
+        filename="data.csv",
+        status=ImportStatus.processing,
+        idempotency_key="retry",
+        created=datetime.datetime.utcnow() - datetime.timedelta(seconds=ImportManager.HEARTBEAT_TTL + 1),
+    )
+    url, data = app.url_path_for("import_raw_create"), FILES_DIR.joinpath("data.csv").read_bytes()
+    headers = {"Content-Type": "text/csv", "Idempotency-Key": "retry"}
+    await ImportManager()._beat(import_["id"])  # a long import which is still running
+    response = await client.post(url, content=data, headers=headers)
+    assert response.status_code == status.HTTP_409_CONFLICT
+
+    await redis_client.delete(ImportManager._get_heartbeat_key(import_["id"]))
+    response = await client.post(url, content=data, headers=headers)
+    assert response.status_code == status.HTTP_201_CREATED
+    imports = await ImportManager().queries.get_entities(filters={"idempotency_key": "retry"}, order_by=["id"])
+    assert [(import_["status"], import_["error"]) for import_ in imports] == [
+        (ImportStatus.failed, "Import was interrupted"),
+        (ImportStatus.finished, None),
+    ]
+
+
+async def test_import_idempotency_key_race(client, monkeypatch):
+    data = FILES_DIR.joinpath("data.csv").read_bytes()
+    response = await client.post(
+        app.url_path_for("import_create"), files={"file": ("data.csv", data)}, headers={"Idempotency-Key": "retry"}
+    )
+    get_by_idempotency_key = ImportManager.queries.get_by_idempotency_key
+    lookups = []
+
+    async def missing_first(self, *args):
+        lookups.append(args)
+        return None if len(lookups) == 1 else await get_by_idempotency_key(self, *args)
+
+    monkeypatch.setattr(ImportManager.queries, "get_by_idempotency_key", missing_first)
+    replayed = await client.post(
+        app.url_path_for("import_create"),
+        files={"file": ("other.csv", data + b"\n")},
+        headers={"Idempotency-Key": "retry"},
+    )
+    assert replayed.status_code == status.HTTP_201_CREATED
+    assert replayed.json() == response.json()
+    assert len(lookups) == 2
+    assert await ImportManager().queries.get_count() == 1
+
+
+async def test_invalid_import_errors(client):
+    data = b"review_time,team,date,merge_time\n1,a,2023-01-01,1\n-1,a,2023-01-02,x\n1,,2023-01-33,1\n"
+    response = await client.post(app.url_path_for("import_create"), files={"file": ("data.csv", data)})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert [(error["row"], error["column"]) for error in response.json()["detail"]] == [
+        (2, "review_time"),
+        (2, "merge_time"),
+        (3, "team"),
+        (3, "date"),
+    ]
+
+
+async def test_invalid_import_errors_in_chunks(client, monkeypatch):
+    monkeypatch.setattr(ImportValidator, "block_size", 100)
+    data = b"review_time,team,date,merge_time\n" + b"".join(b"1,a,2023-01-%02d,1\n" % day for day in range(1, 21))
+    response = await client.post(
+        app.url_path_for("import_create"), files={"file": ("data.csv", data + b"1,a,2023-02-01,-1\n")}
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["detail"][0]["row"] == 21
+
+
+@pytest.mark.parametrize(
+    "column, values",
+    [
+        ("review_time", ["1", "1.0", "2.5", "1e3", "-1", "x", "", "2147483647", "2147483648", "99999999999999999999"]),
+        ("merge_time", ["0", " 7", "+3", "1_000", "1.5e30", "nan"]),
+        ("date", ["2023-01-01", "2023-1-5", "20230101", "1500000000", "1500-01-01", "2300-12-31", "9999-12-31"]),
+        ("date", ["0000-01-01", "2023-02-30", "2023-01-01T00:00", "", "x"]),
+    ],
+)
+def test_validation_parity(column: str, values: list[str]):
+    def get_file(*values: str) -> str:
+        row = {"review_time": "1", "team": "a", "date": "2023-01-01", "merge_time": "1"}
+        rows = ({**row, "team": f"t{i}", column: value} for i, value in enumerate(values))
+        return "\n".join([",".join(row), *(",".join(row.values()) for row in rows)])
+
+    def parse_model(data: str) -> list:
+        parsed = []
+        for record in pandas.read_csv(io.StringIO(data), dtype={"team": str}).to_dict("records"):
+            try:
+                parsed.append(getattr(TeamMetricCSV(**record), column))
+            except pydantic.ValidationError:
+                parsed.append(None)
+        return parsed
+
+    def parse_vectorized(data: str) -> list:
+        try:
+            return getattr(parse_chunk(b"", data.encode(), max_errors=len(values)), column).tolist()
+        except ChunkError as e:
+            invalid = {error["row"] - 1 for error in e.detail}
+            return [None if row in invalid else ... for row in range(data.count("\n"))]
+
+    for value in values:
+        assert parse_vectorized(get_file(value)) == parse_model(get_file(value)), value
+    expected = parse_model(get_file(*values))
+    if None in expected:
+        expected = [... if value is not None else None for value in expected]
+    assert parse_vectorized(get_file(*values)) == expected
+
+
+@pytest.mark.parametrize(
+    "mode, status_code",
+    [(ImportMode.create, status.HTTP_409_CONFLICT), (ImportMode.upsert, status.HTTP_400_BAD_REQUEST)],
+)
+async def test_import_duplicates_across_blocks(client, monkeypatch, mode: ImportMode, status_code: int):
+    monkeypatch.setattr(ImportValidator, "block_size", 100)
+    data = b"review_time,team,date,merge_time\n" + b"".join(b"1,a,2023-01-%02d,1\n" % day for day in range(1, 11))
+    for _ in range(2):  # keys tracked by the first upsert don't leak into the next import
+        response = await client.post(
+            app.url_path_for("import_create"), files={"file": ("data.csv", data)}, params={"mode": "upsert"}
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+    response = await client.post(
+        app.url_path_for("import_create"),
+        files={"file": ("data.csv", data.replace(b"-01-", b"-02-") + b"2,a,2023-02-01,2\n")},  # the first row again
+        params={"mode": mode.value},
+    )
+    assert response.status_code == status_code
+    if mode == ImportMode.upsert:
+        assert response.json()["detail"] == ImportErrors.duplicated_data.value
+    assert await TeamDataManager().queries.get_count() == 10
+
+
+async def test_import_caches_team_ids(client):
+    data = b"review_time,team,date,merge_time\n1,cached,2023-01-01,1\n"
+    response = await client.post(app.url_path_for("import_create"), files={"file": ("data.csv", data)})
+    assert response.status_code == status.HTTP_201_CREATED
+    team_ids, missing = TeamIdsCache().get(1, {"cached"})
+    assert not missing
+    assert team_ids == {"cached": await TeamManager().queries.get_value("id", filters={"name": "cached"})}
+
+    response = await client.post(
+        app.url_path_for("import_create"), files={"file": ("data.csv", data + b"1,new,2023-01-01,1\n")}
+    )
+    assert response.status_code == status.HTTP_409_CONFLICT  # "new" team is rolled back together with the import
+    assert TeamIdsCache().get(1, {"new"}) == ({}, {"new"})
+
+
+async def test_import_upsert(client):
+    data = b"review_time,team,date,merge_time\n1,a,2023-01-01,1\n2,a,2023-01-02,2\n"
+    response = await client.post(app.url_path_for("import_create"), files={"file": ("data.csv", data)})
+    assert response.json() == {"inserted": 2, "updated": 0, "unchanged": 0}
+
+    data = b"review_time,team,date,merge_time\n1,a,2023-01-01,1\n3,a,2023-01-02,2\n3,a,2023-01-03,3\n"
+    response = await client.post(
+        app.url_path_for("import_create"), files={"file": ("data.csv", data)}, params={"mode": ImportMode.upsert.value}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json() == {"inserted": 1, "updated": 1, "unchanged": 1}
+    assert await TeamDataManager().queries.get_value("review_time", filters={"date": datetime.date(2023, 1, 2)}) == 3
+
+
+@pytest.mark.parametrize(
+    "filename,import_status,inserted",
+    [("data.csv", ImportStatus.finished, 96), ("invalid_file_4.csv", ImportStatus.failed, None)],
+)
+async def test_import_job(client, filename: str, import_status: ImportStatus, inserted: int | None):
+    files = {"file": open(FILES_DIR.joinpath(filename), "rb")}
+    response = await client.post(app.url_path_for("import_job_create"), files=files)
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.json()["status"] == ImportStatus.pending
+
+    await asyncio.gather(*ImportManager._jobs)
+    response = await client.get(app.url_path_for("import_job_get", import_id=response.json()["id"]))
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["status"] == import_status
+    assert response.json()["inserted"] == inserted
+    assert "etag" not in response.headers  # job status changes without the data version
+
+
+async def test_import_job_internal_error(client, monkeypatch, caplog):
+    async def fail(self, import_id: int, **values):
+        raise ConnectionError("Connection lost")
+
+    monkeypatch.setattr(ImportManager, "_update", fail)
+    files = {"file": open(FILES_DIR.joinpath("data.csv"), "rb")}
+    response = await client.post(app.url_path_for("import_job_create"), files=files)
+    await asyncio.gather(*ImportManager._jobs)  # the job doesn't raise
+    import_ = await ImportManager().queries.get_entity(filters={"id": response.json()["id"]})
+    assert (import_["status"], import_["error"]) == (ImportStatus.failed, "Internal error")
+    assert f"Import {import_['id']} failed" in caplog.text
+
+
+@pytest.mark.parametrize("lock_scope", list(ImportLockScope))
+async def test_import_lock_scope(client, monkeypatch, lock_scope: ImportLockScope):
+    monkeypatch.setattr(ImportManager, "lock_scope", lock_scope)
+    files = {"file": open(FILES_DIR.joinpath("data.csv"), "rb")}
+    response = await client.post(app.url_path_for("import_create"), files=files)
+    assert response.status_code == status.HTTP_201_CREATED
+
+
+async def test_lock_is_renewed():
+    async with RedisLockClient.get_renewable("test:renewal", timeout=0.3) as lock:
+        await asyncio.sleep(0.5)
+        assert await lock.owned()
+    assert not await lock.locked()
+
+
+async def test_parallel_imports_locked(client, monkeypatch):
+    monkeypatch.setattr(ImportManager, "lock_scope", ImportLockScope.project)
+    monkeypatch.setattr(ImportConfig, "get_default", lambda: ImportConfig(lock_blocking_timeout=0.1))
+    write = ImportManager._write
+
+    async def slow_write(*args):
+        await asyncio.sleep(0.3)  # the first import holds the lock for longer than the second one waits
+        return await write(*args)
+
+    monkeypatch.setattr(ImportManager, "_write", staticmethod(slow_write))
+    responses = await asyncio.gather(
+        *(
+            client.post(
+                app.url_path_for("import_create"),
+                files={"file": (f"{team}.csv", f"review_time,team,date,merge_time\n1,{team},2023-01-01,1\n")},
+            )
+            for team in ("a", "b")
+        )
+    )
+    assert sorted(response.status_code for response in responses) == [
+        status.HTTP_201_CREATED,
+        status.HTTP_409_CONFLICT,
+    ]
+    assert await TeamDataManager().queries.get_count() == 1
+
+
+@pytest.mark.parametrize("failures, is_lost", [(1, False), (100, True)])
+async def test_lock_renewal_survives_redis_errors(monkeypatch, failures: int, is_lost: bool):
+    do_reacquire, calls = RenewableLock.do_reacquire, []
+
+    async def flaky_reacquire(self):
+        calls.append(self)
+        if len(calls) <= failures:
+            raise ConnectionError("Redis is down")
+        return await do_reacquire(self)
+
+    monkeypatch.setattr(RenewableLock, "do_reacquire", flaky_reacquire)
+    monkeypatch.setattr(RenewableLock, "retry_delay", 0.01)
+    finished = False
+    with pytest.raises(LockError) if is_lost else nullcontext():
+        async with RedisLockClient.get_renewable("test:renewal", timeout=0.3) as lock:
+            await asyncio.sleep(0.5)
+            finished = True
+    assert finished != is_lost  # a block without the lock is cancelled
+    assert len(calls) > 1
+    assert not await lock.locked()
+
+
+async def test_lock_lost_after_stop_cancelling(monkeypatch):
+    async def lost(self):
+        raise LockError("Lock expired")
+
+    monkeypatch.setattr(RenewableLock, "do_reacquire", lost)
+    async with RedisLockClient.get_renewable("test:renewal", timeout=0.3) as lock:
+        lock.stop_cancelling()
+        await asyncio.sleep(0.5)  # the commit of the block is not cut off and no error is raised
+
+
+async def test_lock_lost_when_cancelled(monkeypatch):
+    async def hold_lock():
+        async with RedisLockClient.get_renewable("test:renewal", timeout=0.3):
+            await asyncio.sleep(1)
+
+    async def lost(self):
+        task.cancel()  # a cancellation from outside arrives together with the loss of the lock
+        raise LockError("Lock expired")
+
+    monkeypatch.setattr(RenewableLock, "do_reacquire", lost)
+    task = asyncio.create_task(hold_lock())
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+async def iterate_chunks(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start : start + size]
+
+
+@pytest.mark.parametrize("content_encoding", ["identity", "gzip"])
+async def test_import_raw(client, monkeypatch, content_encoding: str):
+    monkeypatch.setattr(ImportValidator, "block_size", 100)
+    data = FILES_DIR.joinpath("data.csv").read_bytes()
+    if content_encoding == "gzip":
+        data = gzip.compress(data)
+    response = await client.post(
+        app.url_path_for("import_raw_create"),
+        content=iterate_chunks(data, 64),
+        headers={"Content-Type": "text/csv", "Content-Encoding": content_encoding},
+        params={"filename": "raw.csv"},
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()["inserted"] == 96
+    assert await TeamDataManager().queries.get_count() == 96
+    assert (await ImportManager().queries.get_entity(filters={"filename": "raw.csv"}))["status"] == "finished"
+
+
+@pytest.mark.parametrize(
+    "headers, content, status_code",
+    [
+        ({"Content-Type": "application/json"}, b"{}", status.HTTP_415_UNSUPPORTED_MEDIA_TYPE),
+        ({"Content-Type": "text/csv", "Content-Encoding": "br"}, b"", status.HTTP_415_UNSUPPORTED_MEDIA_TYPE),
+        ({"Content-Type": "text/csv", "Content-Encoding": "gzip"}, b"not gzip", status.HTTP_400_BAD_REQUEST),
+        (
+            {"Content-Type": "text/csv", "Content-Encoding": "gzip"},
+            gzip.compress(b"a,b\n")[:-4],
+            status.HTTP_400_BAD_REQUEST,
+        ),
+    ],
+)
+async def test_invalid_import_raw(client, headers: dict, content: bytes, status_code: int):
+    response = await client.post(app.url_path_for("import_raw_create"), content=content, headers=headers)
+    assert response.status_code == status_code
+
+
+def get_arrow_table(df: pandas.DataFrame):
+    pyarrow = pytest.importorskip("pyarrow")
+    return pyarrow.Table.from_pandas(df.assign(date=pandas.to_datetime(df["date"]).dt.date), preserve_index=False)
+
+
+def write_arrow_table(table, import_format: ImportFormat) -> bytes:
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    sink = pyarrow.BufferOutputStream()
+    if import_format == ImportFormat.parquet:
+        pyarrow.parquet.write_table(table, sink, row_group_size=40)
+    else:
+        new_file = pyarrow.ipc.new_file if import_format == ImportFormat.arrow_file else pyarrow.ipc.new_stream
+        with new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=40)
+    return sink.getvalue().to_pybytes()
+
+
+@pytest.mark.parametrize("import_format", [ImportFormat.parquet, ImportFormat.arrow_file, ImportFormat.arrow_stream])
+async def test_import_columnar(client, monkeypatch, import_format: ImportFormat):
+    monkeypatch.setattr(ImportValidator, "batch_rows", 25)
+    data = write_arrow_table(get_arrow_table(pandas.read_csv(FILES_DIR.joinpath("data.csv"))), import_format)
+    response = await client.post(
+        app.url_path_for("import_raw_create"), content=data, headers={"Content-Type": import_format.value}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()["inserted"] == 96
+
+    files = {"file": ("data.parquet", data, import_format.value)}  # uploads are chosen by their content type too
+    params = {"mode": ImportMode.upsert.value}
+    response = await client.post(app.url_path_for("import_create"), files=files, params=params)
+    assert response.json() == {"inserted": 0, "updated": 0, "unchanged": 96}
+
+
+async def test_import_columnar_before_epoch(client):
+    df = pandas.DataFrame({"review_time": [1, 2], "team": ["a", "b"], "date": ["1969-12-31"] * 2, "merge_time": 1})
+    data = write_arrow_table(get_arrow_table(df), ImportFormat.parquet)
+    response = await client.post(
+        app.url_path_for("import_raw_create"), content=data, headers={"Content-Type": ImportFormat.parquet.value}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()["inserted"] == 2
+
+
+@pytest.mark.parametrize(
+    "df, detail",
+    [
+        (
+            pandas.DataFrame({"review_time": ["1"], "team": ["a"], "date": ["2023-01-01"], "merge_time": [1]}),
+            "Invalid column types",
+        ),
+        (pandas.DataFrame({"review_time": [1], "team": ["a"], "date": ["2023-01-01"]}), "Missing columns in file"),
+        (
+            pandas.DataFrame(
+                {"review_time": [1, -1], "team": ["a", None], "date": ["2023-01-01"] * 2, "merge_time": 1}
+            ),
+            [
+                {"row": 2, "column": "review_time", "message": "ensure this value is greater than or equal to 0"},
+                {"row": 2, "column": "team", "message": "none is not an allowed value"},
+            ],
+        ),
+        (
+            pandas.DataFrame({"review_time": [1, 2], "team": ["a", "a"], "date": ["2023-01-01"] * 2, "merge_time": 1}),
+            "File contains duplicates",
+        ),
+        (pandas.DataFrame({"review_time": [], "team": [], "date": [], "merge_time": []}), "Empty file"),
+    ],
+)
+async def test_invalid_import_columnar(client, df: pandas.DataFrame, detail):
+    data = write_arrow_table(get_arrow_table(df), ImportFormat.parquet)
+    headers = {"Content-Type": ImportFormat.parquet.value}
+    response = await client.post(app.url_path_for("import_raw_create"), content=data, headers=headers)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["detail"] == detail
+
+
+async def test_invalid_import_columnar_file(client):
+    headers = {"Content-Type": ImportFormat.parquet.value}
+    response = await client.post(app.url_path_for("import_raw_create"), content=b"not parquet", headers=headers)
+    assert (response.status_code, response.json()["detail"]) == (status.HTTP_400_BAD_REQUEST, "Invalid file")
@@ -0,0 +1,256 @@
+import io
+from pathlib import Path
+
+import orjson
+import pandas
+import pytest
+from redis.exceptions import ConnectionError
+from starlette import status
+
+from apps.entities.imports.managers import ImportManager
+from apps.entities.imports.schemas import ImportMode
+from apps.entities.projects import managers
+from apps.entities.projects.managers import ProjectManager
+from apps.entities.teams.managers import TeamDataManager
+from apps.entities.teams.managers import TeamManager
+from apps.entities.teams.schemas import MetricsBucket
+from core.redis import redis_client
+from core.settings import DBConfig
+from db.queries.base import CountMode
+from services.api.main import app
+
+
+FILES_DIR = Path(__file__).resolve().parent.joinpath("test_files")
+
+
+def get_expected(bucket: MetricsBucket, date_from: str, date_to: str, df: pandas.DataFrame = None) -> pandas.DataFrame:
+    if df is None:
+        df = pandas.read_csv(FILES_DIR.joinpath("data.csv"))
+    df = df.assign(date=pandas.to_datetime(df["date"])).sort_values(["team", "date"])
+    period = {MetricsBucket.day: "D", MetricsBucket.week: "W", MetricsBucket.month: "M"}[bucket]
+    df["bucket"] = df["date"].dt.to_period(period).dt.start_time
+    df["end"] = df["date"].dt.to_period(period).dt.end_time.dt.normalize()
+    rows = []
+    for (team, start), group in df.groupby(["team", "bucket"]):
+        end = group["end"].iloc[0]
+        history = df[(df["team"] == team) & (df["date"] <= end)]
+        row = {"team": team, "bucket": start.date().isoformat(), "count": len(group)}
+        for metric in ("review_time", "merge_time"):
+            row[f"{metric}_avg"] = group[metric].mean()
+            row[f"{metric}_min"] = group[metric].min()
+            row[f"{metric}_max"] = group[metric].max()
+            for days in (7, 28):
+                row[f"{metric}_avg_{days}d"] = history[history["date"] > end - pandas.Timedelta(days=days)][
+                    metric
+                ].mean()
+        rows.append(row)
+    expected = pandas.DataFrame(rows)
+    bucket_from = pandas.Timestamp(date_from).to_period(period).start_time.date().isoformat()
+    return expected[(expected["bucket"] >= bucket_from) & (expected["bucket"] <= date_to)]
+
+
+async def assert_team_metrics(client, params: dict, df: pandas.DataFrame = None):
+    response = await client.get(app.url_path_for("team_metrics_get"), params=params)
+    assert response.status_code == status.HTTP_200_OK
+    result = pandas.DataFrame(response.json())
+
+    team_ids = {team["name"]: team["id"] for team in await TeamManager().queries.get_entities()}
+    expected = get_expected(MetricsBucket(params["bucket"]), params["date_from"], params["date_to"], df)
+    expected = expected.assign(team_id=expected["team"].map(team_ids)).sort_values(["team_id", "bucket"])
+    assert len(result) == len(expected)
+    assert result["count"].tolist() == expected["count"].tolist()
+    assert result["bucket"].tolist() == expected["bucket"].tolist()
+    for column in expected.columns.drop(["team", "team_id", "bucket", "count"]):
+        assert result[column].astype(float).tolist() == pytest.approx(expected[column].tolist(), nan_ok=True), column
+
+
+@pytest.mark.parametrize("bucket", list(MetricsBucket))
+async def test_team_metrics(client, bucket: MetricsBucket):
+    files = {"file": open(FILES_DIR.joinpath("data.csv"), "rb")}
+    assert (await client.post(app.url_path_for("import_create"), files=files)).status_code == status.HTTP_201_CREATED
+
+    await assert_team_metrics(client, {"date_from": "2023-02-08", "date_to": "2023-02-14", "bucket": bucket.value})
+
+
+@pytest.mark.parametrize("bucket", [MetricsBucket.week, MetricsBucket.month])
+async def test_team_metrics_rollups_refreshed(client, bucket: MetricsBucket):
+    data = pandas.read_csv(FILES_DIR.joinpath("data.csv"))
+    files = {"file": ("data.csv", data[data.date < "2023-02-01"].to_csv(index=False).encode())}
+    await client.post(app.url_path_for("import_create"), files=files)
+
+    data.loc[data.date >= "2023-01-30", "review_time"] += 1000  # updates the last week of January
+    files = {"file": ("data.csv", data.to_csv(index=False).encode())}
+    await client.post(app.url_path_for("import_create"), files=files, params={"mode": ImportMode.upsert.value})
+
+    await assert_team_metrics(
+        client, {"date_from": "2023-01-01", "date_to": "2023-02-28", "bucket": bucket.value}, data
+    )
+
+
+@pytest.mark.parametrize("bucket", [MetricsBucket.week, MetricsBucket.month])
+async def test_team_metrics_before_epoch(client, bucket: MetricsBucket):
+    data = pandas.DataFrame(
+        {"review_time": [1, 2, 3], "team": "a", "date": ["1969-12-20", "1969-12-31", "1970-01-01"], "merge_time": 1}
+    )
+    files = {"file": ("data.csv", data.to_csv(index=False).encode())}
+    assert (await client.post(app.url_path_for("import_create"), files=files)).status_code == status.HTTP_201_CREATED
+
+    await assert_team_metrics(
+        client, {"date_from": "1969-12-01", "date_to": "1970-01-31", "bucket": bucket.value}, data
+    )
+
+
+async def test_team_metrics_filters(client):
+    files = {"file": open(FILES_DIR.joinpath("data.csv"), "rb")}
+    await client.post(app.url_path_for("import_create"), files=files)
+    params = {"date_from": "2023-01-01", "date_to": "2023-12-31", "bucket": MetricsBucket.month.value}
+    response = await client.get(app.url_path_for("team_metrics_get"), params=params)
+    team_id = response.json()[0]["team_id"]
+
+    response = await client.get(app.url_path_for("team_metrics_get"), params={**params, "team_id": team_id})
+    assert [row["team_id"] for row in response.json()] == [team_id, team_id]
+    assert sum(row["count"] for row in response.json()) == 32
+
+    response = await client.get(app.url_path_for("team_metrics_get"), params={**params, "team_id": team_id + 100})
+    assert response.json() == []
+
+    params = {**params, "date_from": "2023-02-01", "date_to": "2023-01-01"}
+    response = await client.get(app.url_path_for("team_metrics_get"), params=params)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+async def test_team_summary(client):
+    data = pandas.read_csv(FILES_DIR.joinpath("data.csv"))
+    for mode, rows in (
+        (ImportMode.create, data[::2]),
+        (ImportMode.upsert, data.assign(merge_time=data.merge_time + 1)),
+    ):
+        files = {"file": ("data.csv", rows.to_csv(index=False).encode())}
+        response = await client.post(app.url_path_for("import_create"), files=files, params={"mode": mode.value})
+        assert response.status_code == status.HTTP_201_CREATED
+        import_id = (await ImportManager().queries.get_entity(order_by=["-id"]))["id"]
+
+        for team in await TeamManager().queries.get_entities():
+            response = await client.get(app.url_path_for("team_summary_get", team_id=team["id"]))
+            summary, expected = response.json(), rows[rows.team == team["name"]]
+            assert summary["rows_count"] == len(expected)
+            assert summary["review_time_avg"] == pytest.approx(expected.review_time.mean())
+            assert summary["merge_time_avg"] == pytest.approx(expected.merge_time.mean())
+            assert (summary["merge_time_min"], summary["merge_time_max"]) == (
+                expected.merge_time.min(),
+                expected.merge_time.max(),
+            )
+            assert (summary["first_date"], summary["last_date"]) == (expected.date.min(), expected.date.max())
+            assert summary["last_import_id"] == import_id
+
+    response = await client.get(app.url_path_for("team_summary_get", team_id=team["id"] + 100))
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+async def test_team_metrics_etag(client, monkeypatch):
+    params = {"date_from": "2023-01-01", "date_to": "2023-12-31"}
+    response = await client.get(app.url_path_for("team_metrics_get"), params=params)
+    assert response.status_code == status.HTTP_200_OK
+    etag = response.headers["etag"]
+
+    async def fail(*args, **kwargs):
+        raise AssertionError("Endpoint must not run")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(TeamDataManager, "get_aggregates", fail)
+        response = await client.get(
+            app.url_path_for("team_metrics_get"), params=params, headers={"if-none-match": etag}
+        )
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response.headers["etag"] == etag
+
+    await redis_client.delete(ProjectManager._get_data_version_key(1))  # read from the database
+    response = await client.get(app.url_path_for("team_metrics_get"), params=params, headers={"if-none-match": etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    for mode, etag_changed in ((ImportMode.create, True), (ImportMode.upsert, False)):
+        files = {"file": open(FILES_DIR.joinpath("data.csv"), "rb")}
+        await client.post(app.url_path_for("import_create"), files=files, params={"mode": mode.value})
+        response = await client.get(
+            app.url_path_for("team_metrics_get"), params=params, headers={"if-none-match": etag}
+        )
+        assert response.status_code == (status.HTTP_200_OK if etag_changed else status.HTTP_304_NOT_MODIFIED)
+        etag = response.headers["etag"]
+
+
+async def test_team_metrics_etag_publish_failed(client, monkeypatch):
+    params = {"date_from": "2023-01-01", "date_to": "2023-12-31"}
+    etag = (await client.get(app.url_path_for("team_metrics_get"), params=params)).headers["etag"]
+    assert 0 < await redis_client.ttl(ProjectManager._get_data_version_key(1)) <= ProjectManager.DATA_VERSION_TTL
+
+    async def fail(*args, **kwargs):
+        raise ConnectionError("Redis is down")
+
+    monkeypatch.setattr(managers, "SET_MAX_SCRIPT", fail)
+    files = {"file": open(FILES_DIR.joinpath("data.csv"), "rb")}
+    response = await client.post(app.url_path_for("import_create"), files=files)
+    assert response.status_code == status.HTTP_201_CREATED
+    response = await client.get(app.url_path_for("team_metrics_get"), params=params, headers={"if-none-match": etag})
+    assert response.status_code == status.HTTP_200_OK  # the version is read from the database
+    assert response.headers["etag"] != etag
+
+
+async def test_team_data_pages(client):
+    files = {"file": open(FILES_DIR.joinpath("data.csv"), "rb")}
+    await client.post(app.url_path_for("import_create"), files=files)
+
+    rows, params = [], {"limit": 10, "count": CountMode.exact.value, "date_from": "2023-01-20"}
+    while True:
+        response = await client.get(app.url_path_for("team_data_get"), params=params)
+        assert response.status_code == status.HTTP_200_OK
+        page = response.json()
+        assert (page["count"], page["count_is_exact"]) == (78, True)
+        rows += page["items"]
+        if page["next_cursor"] is None:
+            break
+        params["cursor"] = page["next_cursor"]
+    assert len(rows) == 78
+    assert [(row["team_id"], row["date"]) for row in rows] == sorted((row["team_id"], row["date"]) for row in rows)
+
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(DBConfig, "get_default", lambda: DBConfig(count_cap=50))
+        params = {"limit": 10, "count": CountMode.capped.value}
+        page = (await client.get(app.url_path_for("team_data_get"), params=params)).json()
+    assert (page["count"], page["count_is_exact"]) == (50, False)
+
+    params = {"limit": 10, "count": CountMode.estimate.value}
+    page = (await client.get(app.url_path_for("team_data_get"), params=params)).json()
+    assert page["count"] >= 0 and page["count_is_exact"] is False
+
+    response = await client.get(app.url_path_for("team_data_get"), params={"cursor": "invalid"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+async def test_team_data_export(client, monkeypatch):
+    files = {"file": open(FILES_DIR.joinpath("data.csv"), "rb")}
+    await client.post(app.url_path_for("import_create"), files=files)
+    monkeypatch.setattr(DBConfig, "get_default", lambda: DBConfig(cursor_batch_size=10))  # several batches
+    expected = pandas.read_csv(FILES_DIR.joinpath("data.csv"))[["team", "date", "review_time", "merge_time"]]
+    expected = expected.sort_values(["team", "date"], ignore_index=True)
+
+    headers = {"Accept-Encoding": "br"}
+    response = await client.get(app.url_path_for("team_data_export"), params={"format": "csv"}, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert (response.headers["content-type"], response.headers["content-encoding"]) == ("text/csv; charset=utf-8", "br")
+    df = pandas.read_csv(io.StringIO(response.text))
+    pandas.testing.assert_frame_equal(df.sort_values(["team", "date"], ignore_index=True), expected)
+    ids = await TeamManager().get_or_create_ids(set(df["team"]))
+    keys = list(zip(df["team"].map(ids), df["date"]))
+    assert keys == sorted(keys)  # in the order of `team_data_unique`
+
+    params = {"format": "ndjson", "date_from": "2023-01-20"}
+    response = await client.get(app.url_path_for("team_data_export"), params=params, headers=headers)
+    assert response.headers["content-type"] == "application/x-ndjson"
+    df = pandas.DataFrame([orjson.loads(line) for line in response.text.splitlines()])
+    expected = expected[expected["date"] >= "2023-01-20"].reset_index(drop=True)
+    pandas.testing.assert_frame_equal(df.sort_values(["team", "date"], ignore_index=True), expected)
+
+
+def test_openapi():
+    paths = app.openapi()["paths"]
+    assert "200" in paths[app.url_path_for("team_data_export")]["get"]["responses"]
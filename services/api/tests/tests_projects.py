@@ -0,0 +1,65 @@
+import asyncio
+
+from starlette import status
+
+from apps.entities.projects.cache import ProjectIdsCache
+from apps.entities.projects.managers import ProjectManager
+from services.api.main import app
+from services.api.main import startup
+
+
+async def wait_for(condition, timeout: float = 5):
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.01)
+
+
+async def test_project_onboarded(client):
+    url = app.url_path_for("team_data_get")
+    await ProjectManager().load_ids()
+    project_id = (await ProjectManager().queries.create(name="unannounced"))["id"]
+    response = await client.get(url, headers={"project-id": str(project_id)})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST  # requests are checked without the database
+
+    project_id = (await ProjectManager().create("onboarded"))["id"]
+    response = await client.get(url, headers={"project-id": str(project_id)})
+    assert response.status_code == status.HTTP_200_OK
+
+
+async def test_projects_reloaded_on_change(monkeypatch):
+    await ProjectManager().load_ids()
+    reloads, load_ids = [], ProjectManager.load_ids
+
+    async def counted_load_ids(self):
+        await load_ids(self)
+        reloads.append(self)
+
+    monkeypatch.setattr(ProjectManager, "load_ids", counted_load_ids)
+    ProjectManager.start_listening()
+    try:
+        await wait_for(lambda: len(reloads) == 1)  # on subscribing
+        project_id = (await ProjectManager().queries.create(name="another worker"))["id"]  # unknown to this process
+        assert project_id not in ProjectIdsCache()
+
+        await ProjectManager.publish_projects_change()
+        await wait_for(lambda: project_id in ProjectIdsCache())
+    finally:
+        await ProjectManager.stop_listening()
+
+
+async def test_project_ids_loaded_lazily_if_startup_fails(client, monkeypatch):
+    load_ids = ProjectManager.load_ids
+
+    async def fail(self):
+        raise ConnectionError("database is down")
+
+    ProjectIdsCache().invalidate()
+    monkeypatch.setattr(ProjectManager, "load_ids", fail)
+    monkeypatch.setattr(ProjectManager, "start_listening", lambda: None)
+    await startup()
+    assert not ProjectIdsCache().is_loaded
+
+    monkeypatch.setattr(ProjectManager, "load_ids", load_ids)
+    response = await client.get(app.url_path_for("team_data_get"))
+    assert response.status_code == status.HTTP_200_OK
+    assert ProjectIdsCache().is_loaded
@@ -0,0 +1,185 @@
+import base64
+import datetime
+from contextlib import aclosing
+
+import orjson
+import pytest
+
+from core.contexts import PROJECT_ID
+from core.exceptions import BadRequestException
+from core.exceptions import ConflictException
+from db import get_database
+from db.backends import statement_cache
+from db.models import imports
+from db.models import team
+from db.models import team_data
+from db.queries.base import BaseQuery
+from db.queries.base import ResultMode
+from services.api.main import app
+
+
+def get_sql(q) -> str:
+    return str(q.compile(compile_kwargs={"literal_binds": True}))
+
+
+def test_filters_longest_suffix():
+    query = BaseQuery(conn=get_database(), table_model=team_data)
+    q = query.filters(
+        team_data.select(),
+        filters={
+            "created__date__lt": datetime.date(2023, 1, 1),
+            "team_id__not_in": [1],
+            "team_id__in": [2],
+            "review_time__or__merge_time": 3,
+            "unknown__in": [4],
+        },
+    )
+    assert get_sql(q).split("WHERE ")[1] == (
+        "date(team_data.created) < '2023-01-01' AND (team_data.team_id NOT IN (1)) AND team_data.team_id IN (2) "
+        "AND (team_data.review_time = 3 OR team_data.merge_time = 3)"
+    )
+
+
+def test_filters_plan_is_cached():
+    query = BaseQuery(conn=get_database(), table_model=team_data)
+    keys = ("team_id__in", "date__gte")
+    other = BaseQuery(conn=get_database(), table_model=team_data)
+    assert query._get_filter_plan(team_data, keys) is other._get_filter_plan(team_data, keys)
+    first = get_sql(
+        query.filters(team_data.select(), filters={"team_id__in": [1], "date__gte": datetime.date(2023, 1, 1)})
+    )
+    second = get_sql(
+        query.filters(team_data.select(), filters={"team_id__in": [2], "date__gte": datetime.date(2023, 2, 1)})
+    )
+    assert "IN (1)" in first and "2023-01-01" in first
+    assert "IN (2)" in second and "2023-02-01" in second
+
+
+async def test_statement_cache():
+    query = BaseQuery(conn=get_database(), table_model=team)
+    await query.get_entities(filters={"project_id": 1})
+    await query.is_exists_entity(filters={"project_id": 1})
+    await query.get_count(filters={"name__in": ["a", "b"]})
+    stats = statement_cache.get_stats()
+
+    await query.get_entities(filters={"project_id": 2})
+    await query.is_exists_entity(filters={"project_id": 2})
+    assert await query.get_count(filters={"name__in": ["c", "d"]}) == 0
+    assert statement_cache.get_stats() == {**stats, "hits": stats["hits"] + 3}
+
+    await query.get_count(filters={"name__in": ["c", "d", "e"]})  # another number of parameters
+    assert statement_cache.get_stats()["misses"] == stats["misses"] + 1
+
+
+async def test_statement_cache_disabled_on_incompatible_sqlalchemy(monkeypatch, client):
+    def incompatible(*args):
+        raise AttributeError("'Compiled' object has no attribute '_bind_processors'")
+
+    statement_cache.clear()
+    monkeypatch.setattr(statement_cache, "is_enabled", True)
+    monkeypatch.setattr(statement_cache, "_prepare", incompatible)
+    assert await BaseQuery(conn=get_database(), table_model=team).get_count(filters={"project_id": 1}) == 0
+    assert statement_cache.get_stats() == {"enabled": False, "hits": 0, "misses": 1, "size": 0}
+
+    response = await client.get(app.url_path_for("stats_get"))
+    assert response.json()["statement_cache"] == statement_cache.get_stats()
+
+
+async def test_statement_cache_processes_parameters_with_in():
+    PROJECT_ID.set(1)
+    query = BaseQuery(conn=get_database(), table_model=imports)
+    created = await query.create(filename="data.csv", status="pending")
+    updated = await query.update(
+        filters={"id": created["id"], "status__in": ["pending", "processing"]}, values={"error": "Internal error"}
+    )
+    assert updated["error"] == "Internal error"  # serialized to JSON like without IN
+
+
+async def test_result_modes():
+    PROJECT_ID.set(1)
+    query = BaseQuery(conn=get_database(), table_model=imports)
+    created = await query.bulk_create(
+        [{"filename": f"{i}.csv", "project_id": 1, "error": {"row": i}} for i in range(3)],
+        result_mode=ResultMode.tuple,
+    )
+    assert [row[2] for row in created] == ["0.csv", "1.csv", "2.csv"]
+
+    kwargs = {"filters": {"project_id": 1}, "order_by": ["id"], "return_fields": ["id", "filename", "error"]}
+    dicts = await query.get_entities(**kwargs)
+    assert dicts[0]["error"] == {"row": 0}  # JSON is processed in every mode
+    assert await query.get_entities(result_mode=ResultMode.tuple, **kwargs) == [tuple(row.values()) for row in dicts]
+    assert [record["filename"] for record in await query.get_entities(result_mode=ResultMode.record, **kwargs)] == [
+        row["filename"] for row in dicts
+    ]
+    columns = await query.get_entities(result_mode=ResultMode.columns, **kwargs)
+    assert list(columns) == ["id", "filename", "error"]
+    assert columns["id"].dtype.kind == "i"
+    assert columns["filename"].tolist() == [row["filename"] for row in dicts]
+    assert await query.get_entity(result_mode=ResultMode.tuple, **kwargs) == tuple(dicts[0].values())
+    assert await query.get_entities(result_mode=ResultMode.columns, filters={"project_id": 2}) == {}
+
+
+async def test_iterate_entities():
+    PROJECT_ID.set(1)
+    query = BaseQuery(conn=get_database(), table_model=imports)
+    await query.bulk_create([{"filename": f"{i:02}.csv"} for i in range(25)], is_returning=False)
+
+    kwargs = {"filters": {"filename__ilike": "%.csv"}, "order_by": ["-filename"], "return_fields": ["filename"]}
+    batches = [batch async for batch in query.iterate_entities(batch_size=10, **kwargs)]
+    assert [len(batch) for batch in batches] == [10, 10, 5]
+    assert [row["filename"] for batch in batches for row in batch] == [f"{i:02}.csv" for i in reversed(range(25))]
+
+    async with aclosing(query.iterate_entities(batch_size=20, result_mode=ResultMode.columns, **kwargs)) as batches:
+        async for batch in batches:
+            assert await query.get_count(filters={"project_id": 1}) == 25  # the connection is free between batches
+            assert batch["filename"].tolist()[:2] == ["24.csv", "23.csv"]
+            break
+    assert await query.get_count(filters={"project_id": 1}) == 25
+
+
+async def test_keyset_pages():
+    PROJECT_ID.set(1)
+    query = BaseQuery(conn=get_database(), table_model=imports)
+    await query.bulk_create([{"filename": f"{i % 3}.csv"} for i in range(10)], is_returning=False)
+
+    kwargs = {"filters": {"project_id": 1}, "order_by": ["-filename"], "return_fields": ["filename"]}
+    expected = await query.get_entities_by_query(
+        query.prepare_query(**kwargs).order_by(imports.c.id), result_mode=ResultMode.tuple
+    )
+    rows, cursor = [], None
+    while True:
+        page = await query.get_entities_page(limit=3, cursor=cursor, **kwargs)
+        rows += [(row["filename"], row["id"]) for row in page.items]
+        if (cursor := page.next_cursor) is None:
+            break
+    assert rows == sorted(rows, key=lambda row: (-int(row[0][0]), row[1]))  # the primary key breaks ties
+    assert [filename for filename, _ in rows] == sorted((filename for (filename,) in expected), reverse=True)
+
+    tampered = base64.urlsafe_b64encode(orjson.dumps(["0.csv", "id"])).decode()
+    with pytest.raises(BadRequestException):
+        await query.get_entities_page(limit=3, cursor=tampered, **kwargs)
+
+
+async def test_bulk_upsert_and_update():
+    PROJECT_ID.set(1)
+    teams = BaseQuery(conn=get_database(), table_model=team)
+    created = await teams.bulk_upsert([{"name": "bulk a"}, {"name": "bulk b"}], is_returning=True)
+    upserted = await teams.bulk_upsert([{"name": "bulk b"}, {"name": "bulk c"}], is_returning=True)
+    assert [(row["name"], row["project_id"]) for row in upserted] == [("bulk b", 1), ("bulk c", 1)]
+    assert upserted[0]["id"] == created[1]["id"]
+    names = await teams.get_entities(filters={"name__in": ["bulk a", "bulk b", "bulk c"]}, order_by=["name"])
+    assert [(row["id"], row["name"]) for row in names] == [(row["id"], row["name"]) for row in [created[0], *upserted]]
+    columns = await teams.bulk_upsert([{"name": "bulk c"}], is_returning=True, result_mode=ResultMode.columns)
+    assert list(columns["id"]) == [upserted[1]["id"]]
+
+    query = BaseQuery(conn=get_database(), table_model=imports)
+    ids = [row["id"] for row in await query.bulk_create([{"filename": f"{i}.csv"} for i in range(5)])]
+    statement_cache.clear()
+    await query.bulk_update([{"id": ids[0], "filename": "first.csv"}])
+    await query.bulk_update([{"id": id_, "filename": f"{id_}.json"} for id_ in ids[1:]])
+    assert statement_cache.hits == 1  # arrays are single parameters, the statement doesn't depend on the batch size
+    rows = await query.get_entities(filters={"id__in": ids}, order_by=["id"], return_fields=["filename"])
+    assert [row["filename"] for row in rows] == ["first.csv", *(f"{id_}.json" for id_ in ids[1:])]
+
+    with pytest.raises(ConflictException):  # not the conflict target, which is the primary key of imports
+        await query.bulk_upsert([{"filename": "a.csv", "idempotency_key": "bulk"}] * 2)
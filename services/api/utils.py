@@ -1,19 +1,35 @@
+import csv
+import io
 import typing
+from collections.abc import AsyncIterator
+from collections.abc import Callable
+from collections.abc import Coroutine
+from collections.abc import Sequence
+from contextlib import aclosing
+from enum import Enum
+from enum import unique
 from typing import Any
 
 import orjson
 from fastapi import APIRouter
 from fastapi import Depends
+from fastapi import Request
+from fastapi import Response
 from fastapi.responses import ORJSONResponse as ORJSONResp
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRoute
 from starlette import status
 from starlette.background import BackgroundTask
 
+from apps.entities.projects.managers import ProjectManager
 from core.utils import orjson_dumps
 from services.api import deps
 from services.api.schemas.responses import BadRequestMessage
 from services.api.schemas.responses import ForbiddenMessage
 from services.api.schemas.responses import NotFoundMessage
 
+ORJSON_OPTION = orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z | orjson.OPT_NAIVE_UTC
+
 
 class ORJSONResponse(ORJSONResp):
     def __init__(
@@ -27,11 +43,87 @@ class ORJSONResponse(ORJSONResp):
         super().__init__(content, status_code, headers, media_type, background)
 
     def render(self, content: Any) -> bytes:
-        return orjson_dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z | orjson.OPT_NAIVE_UTC)
+        return orjson_dumps(content, option=ORJSON_OPTION)
+
+
+@unique
+class ExportFormat(str, Enum):
+    csv = "csv"
+    ndjson = "ndjson"  # a JSON object per line
+
+
+class ExportResponse(StreamingResponse):
+    """Rows streamed in batches as CSV or NDJSON, only one batch is held and serialized at a time."""
+
+    MEDIA_TYPES = {ExportFormat.csv: "text/csv", ExportFormat.ndjson: "application/x-ndjson"}
+
+    def __init__(
+        self,
+        batches: AsyncIterator[Sequence[tuple]],
+        columns: Sequence[str],
+        export_format: ExportFormat,
+        filename: str,
+    ) -> None:
+        super().__init__(
+            self._serialize(batches, columns, export_format),
+            media_type=self.MEDIA_TYPES[export_format],
+            headers={"Content-Disposition": f'attachment; filename="{filename}.{export_format.value}"'},
+        )
+
+    @staticmethod
+    async def _serialize(
+        batches: AsyncIterator[Sequence[tuple]], columns: Sequence[str], export_format: ExportFormat
+    ) -> AsyncIterator[bytes]:
+        async with aclosing(batches):  # the cursor is closed if the client goes away
+            if export_format == ExportFormat.csv:
+                yield get_csv_chunk([columns])
+                async for rows in batches:
+                    yield get_csv_chunk(rows)
+            else:
+                async for rows in batches:
+                    yield b"".join(orjson_dumps(dict(zip(columns, row)), option=ORJSON_OPTION) + b"\n" for row in rows)
+
+
+def get_csv_chunk(rows: Sequence[Sequence]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    return buffer.getvalue().encode()
+
+
+class ConditionalGetRoute(APIRoute):
+    """Route answering GET requests with an ETag of the project data version."""
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        handler = super().get_route_handler()
+
+        async def conditional_handler(request: Request) -> Response:
+            if request.method != "GET" or (etag := await self._get_etag(request)) is None:
+                return await handler(request)
+            headers = {"ETag": etag, "Cache-Control": "no-cache"}
+            if etag in {tag.strip() for tag in request.headers.get("if-none-match", "").split(",")}:
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+            response = await handler(request)
+            if response.status_code == status.HTTP_200_OK:
+                response.headers.update(headers)
+            return response
+
+        return conditional_handler
+
+    @staticmethod
+    async def _get_etag(request: Request) -> str | None:
+        """The version is read before the endpoint runs, so data changed meanwhile never gets an older ETag."""
+        try:
+            project_id = int(request.headers.get("project-id", ""))
+        except ValueError:
+            return None
+        if not await ProjectManager().is_exists(project_id):
+            return None  # the request is rejected by `deps.project_id_for_rest`
+        return f'W/"{project_id}-{await ProjectManager().get_data_version(project_id)}"'
 
 
-def get_router():
+def get_router(conditional_get: bool = True):
     return APIRouter(
+        route_class=ConditionalGetRoute if conditional_get else APIRoute,
         responses={
             status.HTTP_400_BAD_REQUEST: {"model": BadRequestMessage},
             status.HTTP_401_UNAUTHORIZED: {"model": ForbiddenMessage},
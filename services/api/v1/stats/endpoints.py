@@ -0,0 +1,15 @@
+from fastapi import APIRouter
+
+from db.backends import statement_cache
+from services.api.middlewares import compression_stats
+
+router = APIRouter()  # stats of the process, which are not bound to a project
+
+
+@router.get(
+    path="",
+    operation_id="stats_get",
+    response_model=dict,
+)
+async def stats_get():
+    return {"statement_cache": statement_cache.get_stats(), "compression": compression_stats.get_stats()}
@@ -1,18 +1,82 @@
+from collections.abc import AsyncIterator
+
+from fastapi import Depends
+from fastapi import Header
 from fastapi import UploadFile
+from pydantic import constr
 from starlette import status
 
 from apps.entities.imports.managers import ImportManager
+from apps.entities.imports.schemas import ImportFormat
+from apps.entities.imports.schemas import ImportJob
+from apps.entities.imports.schemas import ImportMode
+from apps.entities.imports.schemas import ImportResult
+from core.types import EntityId
+from services.api import deps
 from services.api.utils import get_router
 
-router = get_router()
+# a retried request with the same key returns the result of the original one
+IdempotencyKey = constr(min_length=1, max_length=255) | None
+
+router = get_router(conditional_get=False)  # status of jobs changes without the data version
 
 
 @router.post(
     path="",
     operation_id="import_create",
     status_code=status.HTTP_201_CREATED,
+    response_model=ImportResult,
 )
 async def import_create(
     file: UploadFile,
+    mode: ImportMode = ImportMode.create,
+    idempotency_key: IdempotencyKey = Header(None),
+):
+    return await ImportManager().create(file, mode, idempotency_key)
+
+
+@router.post(
+    path="/raw",
+    operation_id="import_raw_create",
+    status_code=status.HTTP_201_CREATED,
+    response_model=ImportResult,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {media_type: {"schema": {"type": "string", "format": "binary"}} for media_type in ImportFormat},
+        }
+    },
+)
+async def import_raw_create(
+    chunks: AsyncIterator[bytes] = Depends(deps.request_body),
+    import_format: ImportFormat = Depends(deps.import_format),
+    mode: ImportMode = ImportMode.create,
+    filename: constr(min_length=1, max_length=255) = "data.csv",
+    idempotency_key: IdempotencyKey = Header(None),
+):
+    return await ImportManager().create_from_stream(chunks, filename, mode, import_format, idempotency_key)
+
+
+@router.post(
+    path="/jobs",
+    operation_id="import_job_create",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=ImportJob,
+)
+async def import_job_create(
+    file: UploadFile,
+    mode: ImportMode = ImportMode.create,
+    idempotency_key: IdempotencyKey = Header(None),
+):
+    return await ImportManager().create_job(file, mode, idempotency_key)
+
+
+@router.get(
+    path="/jobs/{import_id}",
+    operation_id="import_job_get",
+    response_model=ImportJob,
+)
+async def import_job_get(
+    import_id: EntityId,
 ):
-    return await ImportManager().create(file)
+    return await ImportManager().get_job(import_id)
@@ -0,0 +1,76 @@
+import datetime
+
+from fastapi import Query
+from pydantic import conint
+from starlette import status
+
+from apps.entities.teams.managers import TeamDataManager
+from apps.entities.teams.schemas import MetricsBucket
+from apps.entities.teams.schemas import TeamDataPage
+from apps.entities.teams.schemas import TeamMetricsAggregate
+from apps.entities.teams.schemas import TeamSummary
+from core.types import EntityId
+from db.queries.base import CountMode
+from services.api.utils import ExportFormat
+from services.api.utils import ExportResponse
+from services.api.utils import get_router
+
+router = get_router()
+
+
+@router.get(
+    path="",
+    operation_id="team_metrics_get",
+    response_model=list[TeamMetricsAggregate],
+)
+async def team_metrics_get(
+    date_from: datetime.date,
+    date_to: datetime.date,
+    bucket: MetricsBucket = MetricsBucket.day,
+    team_id: list[EntityId] | None = Query(None),
+):
+    return await TeamDataManager().get_aggregates(date_from, date_to, bucket, team_id)
+
+
+@router.get(
+    path="/teams/{team_id}",
+    operation_id="team_summary_get",
+    response_model=TeamSummary,
+)
+async def team_summary_get(
+    team_id: EntityId,
+):
+    return await TeamDataManager().get_summary(team_id)
+
+
+@router.get(
+    path="/data",
+    operation_id="team_data_get",
+    response_model=TeamDataPage,
+)
+async def team_data_get(
+    limit: conint(ge=1, le=1000) = 100,
+    cursor: str | None = None,
+    count: CountMode = CountMode.none,
+    date_from: datetime.date | None = None,
+    date_to: datetime.date | None = None,
+    team_id: list[EntityId] | None = Query(None),
+):
+    return await TeamDataManager().get_page(limit, cursor, count, date_from, date_to, team_id)
+
+
+@router.get(
+    path="/data/export",
+    operation_id="team_data_export",
+    status_code=status.HTTP_200_OK,  # isn't inferred from the signature of a streaming response class
+    response_class=ExportResponse,
+)
+async def team_data_export(
+    export_format: ExportFormat = Query(ExportFormat.csv, alias="format"),
+    date_from: datetime.date | None = None,
+    date_to: datetime.date | None = None,
+    team_id: list[EntityId] | None = Query(None),
+):
+    manager = TeamDataManager()
+    batches = manager.iterate_export(date_from, date_to, team_id)
+    return ExportResponse(batches, manager.queries.EXPORT_COLUMNS, export_format, filename="team_data")